@@ -0,0 +1,167 @@
+"""
+Registry of the corpus.
+
+Books and their chapters are listed from `manifest.json`, which is
+small and cheap to read. Chapter text is read from the memory-mapped
+corpus store in `data/` (see `corpus_store.py`) when one has been
+built from the current manifest, so processes share one page-cache
+copy of it. Otherwise a book's module is imported the first time one
+of its chapters is asked for.
+
+After adding or re-splitting a book module, regenerate the manifest
+with `python -m books`; the manifest records a hash of each module,
+so a store built before then is ignored until it is rebuilt.
+"""
+
+import ast
+from functools import lru_cache
+import hashlib
+import importlib
+import json
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+BOOKS_DIR = Path(__file__).parent
+MANIFEST_PATH = BOOKS_DIR / "manifest.json"
+
+# Module-level names that describe a book rather than hold its text.
+METADATA_FIELDS = ("title", "author", "contents", "front_matter")
+
+
+@lru_cache(maxsize=None)
+def load_manifest():
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_books() -> List[str]:
+    return [book["id"] for book in load_manifest()["books"]]
+
+
+def get_book(book_id: str):
+    for book in load_manifest()["books"]:
+        if book["id"] == book_id:
+            return book
+
+    raise KeyError(f"Unknown book: {book_id}")
+
+
+def list_chapters(book_id: str) -> List[str]:
+    return get_book(book_id)["chapters"]
+
+
+def manifest_hash() -> str:
+    return hashlib.sha256(MANIFEST_PATH.read_bytes()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def load_store():
+    """
+    The corpus store, or None if none has been built or it was built
+    from another manifest.
+    """
+    # Imported here: corpus_store builds itself from this registry.
+    from corpus_store import DEFAULT_STORE_DIR, INDEX_NAME, CorpusStore
+
+    if not (DEFAULT_STORE_DIR / INDEX_NAME).exists():
+        return None
+
+    store = CorpusStore(DEFAULT_STORE_DIR)
+    if store.manifest_hash != manifest_hash():
+        store.close()
+        return None
+
+    return store
+
+
+def module_chapter(book_id: str, chapter_id: str) -> str:
+    module = importlib.import_module(f"books.{book_id}")
+    return getattr(module, chapter_id)
+
+
+def get_chapter(book_id: str, chapter_id: str) -> str:
+    if chapter_id not in list_chapters(book_id):
+        raise KeyError(f"Unknown chapter: {book_id}.{chapter_id}")
+
+    store = load_store()
+    if store is not None and (book_id, chapter_id) in store:
+        return store.chapter(book_id, chapter_id)
+
+    return module_chapter(book_id, chapter_id)
+
+
+def iter_chapters(
+    book_ids: Optional[Iterable[str]] = None,
+    from_modules: bool = False,
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    (book, chapter, text) records for the given books, or for the whole
+    corpus, in manifest order. `from_modules` bypasses the store.
+    """
+    read = module_chapter if from_modules else get_chapter
+
+    for book_id in book_ids if book_ids is not None else list_books():
+        for chapter_id in list_chapters(book_id):
+            yield book_id, chapter_id, read(book_id, chapter_id)
+
+
+def first_paragraph(text: str) -> str:
+    paragraph = text.strip().split("\n\n")[0]
+    return " ".join(line.strip() for line in paragraph.splitlines())
+
+
+def scan_book(path: Path):
+    """
+    Read a book module's title and chapter names from its source,
+    without importing it. Chapters are its module-level strings other
+    than the metadata fields, in the order they first appear.
+    """
+    source = path.read_bytes()
+    tree = ast.parse(source.decode("utf-8"))
+
+    title = None
+    chapters = []
+
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+
+        value = node.value
+        if not (
+            isinstance(value, ast.Constant)
+            and isinstance(value.value, str)
+        ):
+            continue
+
+        for target in node.targets:
+            if target.id == "title":
+                title = first_paragraph(value.value)
+            elif target.id not in METADATA_FIELDS:
+                if target.id not in chapters:
+                    chapters.append(target.id)
+
+    return {
+        "id": path.stem,
+        "title": title,
+        "chapters": chapters,
+        "hash": hashlib.sha256(source).hexdigest(),
+    }
+
+
+def build_manifest():
+    return {
+        "books": [
+            scan_book(path)
+            for path in sorted(BOOKS_DIR.glob("*.py"))
+            if not path.name.startswith("_")
+        ]
+    }
+
+
+def write_manifest():
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(build_manifest(), f, indent=2)
+        f.write("\n")
+
+    load_manifest.cache_clear()
+    load_store.cache_clear()
@@ -0,0 +1,4 @@
+from books import MANIFEST_PATH, write_manifest
+
+write_manifest()
+print(f"Wrote {MANIFEST_PATH}")
@@ -0,0 +1,478 @@
+"""
+Chapter detection for Project Gutenberg texts.
+
+`detect_chapters` splits the body of a book (header and footer already
+removed) into front matter and chapters. Front matter is only the
+credits, title pages and contents tables; everything the author wrote
+is a chapter. It recognises, in order of precedence:
+
+- chapter headings: "CHAPTER 1.", "Chapter XIV", "CHAPTER I: TITLE",
+  "CHAPTER THE FIRST", "CHAPTER ONE", and the same with BOOK or PART,
+- headings named in the book's contents table, e.g. "OF THEIR TOWNS"
+  under a "Contents" list that includes it,
+- Roman numerals standing alone on a line,
+- section markers ("Section 2", a bare "2"),
+- scene breaks ("*   *   *").
+
+Only the highest kind present in a book splits it, so numbered sections
+inside chapters stay inside their chapter. A heading whose number is
+not above the previous heading's of the same kind restarts that
+sequence, which is how contents tables and repeated title pages are
+told apart from the chapters they list.
+
+Before the first of those, prefatory headings ("PREFACE", "AUTHOR'S
+PREFACE", "INTRODUCTION", "A NOTE TO THE READER", ...) start chapters
+named after them, and prose that opens the book under no heading at
+all is an "opening" chapter.
+
+Lines are scanned once; choosing among the candidate headings only
+walks the candidates.
+"""
+
+import re
+from typing import List, Optional
+
+NUMBER_WORDS = (
+    "one two three four five six seven eight nine ten eleven twelve "
+    "thirteen fourteen fifteen sixteen seventeen eighteen nineteen "
+    "twenty"
+).split()
+
+ORDINAL_WORDS = (
+    "first second third fourth fifth sixth seventh eighth ninth tenth "
+    "eleventh twelfth thirteenth fourteenth fifteenth sixteenth "
+    "seventeenth eighteenth nineteenth twentieth"
+).split()
+
+ROMAN_VALUES = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100, "d": 500}
+
+NUMBER = (
+    r"(?P<number>\d{1,3}|[ivxlcd]+|"
+    + "|".join(ORDINAL_WORDS + NUMBER_WORDS)
+    + r")"
+)
+
+CHAPTER_HEADING = re.compile(
+    rf"^(?:chapter|book|part)\s+(?:the\s+)?{NUMBER}\b\.?"
+    r"(?:\s*(?::|--|—|-|\.)\s*(?P<title>.+))?$",
+    re.IGNORECASE,
+)
+ROMAN_HEADING = re.compile(r"^(?P<number>[IVXLCD]+)\.?$")
+SECTION_HEADING = re.compile(
+    r"^(?:section\s+)?(?P<number>\d{1,3})\.?$",
+    re.IGNORECASE,
+)
+SCENE_BREAK = re.compile(r"^\*(?:\s*\*){2,}$")
+CONTENTS_HEADING = re.compile(
+    r"^(?:table of )?contents\.?$", re.IGNORECASE
+)
+PREFATORY_HEADING = re.compile(
+    r"^(?:(?:the|a|an)\s+)?(?:[a-z]+['’]s\s+)?"
+    r"(?P<kind>preface|foreword|introduction|prologue|"
+    r"acknowledge?ments?|note)(?:\s+to\s+the\s+[a-z]+)?\.?$",
+    re.IGNORECASE,
+)
+
+# Gutenberg conversion residue, dropped wherever it appears.
+RESIDUE_LINE = re.compile(r"^JTABLE(?:\s+\d+)*$")
+
+# Kinds of heading, grouped by precedence. A book is split on the
+# first group it has any headings of.
+LEVELS = (
+    ("chapter", "contents"),
+    ("numeral",),
+    ("section",),
+    ("break",),
+)
+
+# Longest line that can be a contents entry or a heading's subtitle.
+MAX_TITLE_LENGTH = 80
+
+# Headings followed by less text than this before the next heading
+# are title pages or listings rather than chapters.
+MIN_CHAPTER_CHARS = 200
+
+
+def parse_number(token: str) -> Optional[int]:
+    token = token.lower()
+
+    if token.isdigit():
+        return int(token)
+    if token in NUMBER_WORDS:
+        return NUMBER_WORDS.index(token) + 1
+    if token in ORDINAL_WORDS:
+        return ORDINAL_WORDS.index(token) + 1
+    if not set(token) <= set(ROMAN_VALUES):
+        return None
+
+    total = 0
+    for current, following in zip(token, token[1:] + " "):
+        value = ROMAN_VALUES[current]
+        if value < ROMAN_VALUES.get(following, 0):
+            total -= value
+        else:
+            total += value
+
+    return total
+
+
+def normalize_title(line: str) -> str:
+    return " ".join(line.strip(" _*").split()).casefold()
+
+
+def create_heading(
+    kind: str,
+    line: int,
+    end_line: int,
+    title: Optional[str],
+    number: Optional[int] = None,
+):
+    return {
+        "kind": kind,
+        "line": line,
+        "end_line": end_line,
+        "title": title,
+        "number": number,
+    }
+
+
+def create_chapter(chapter_id: str, title: Optional[str], text: str):
+    return {
+        "id": chapter_id,
+        "title": title,
+        "text": text,
+    }
+
+
+def find_subtitle(lines: List[str], index: int):
+    """
+    The title under the heading at `index`, if any: a short line by
+    itself, directly below the heading or after one blank line. Returns
+    it with the index of the line the chapter's text starts at.
+    """
+    for offset in (1, 2):
+        position = index + offset
+        if position + 1 >= len(lines):
+            break
+
+        line = lines[position].strip()
+        if not line:
+            continue
+
+        if (
+            len(line) <= MAX_TITLE_LENGTH
+            and not lines[position + 1].strip()
+            and not SECTION_HEADING.match(line)
+            and not ROMAN_HEADING.match(line)
+        ):
+            return line, position + 1
+        break
+
+    return None, index + 1
+
+
+def find_headings(lines: List[str]):
+    """
+    Every line that could be a heading, in one pass over `lines`.
+    """
+    headings = []
+    contents_entries = set()
+    collecting_contents = False
+    blank_run = 0
+
+    def is_blank(index):
+        return (
+            index < 0 or index >= len(lines) or not lines[index].strip()
+        )
+
+    for index, raw_line in enumerate(lines):
+        line = raw_line.strip()
+
+        if not line:
+            blank_run += 1
+            # A wide gap also ends a contents table.
+            if blank_run >= 3:
+                collecting_contents = False
+            continue
+
+        isolated = is_blank(index - 1) and is_blank(index + 1)
+        blank_run = 0
+
+        if CONTENTS_HEADING.match(line):
+            collecting_contents = True
+            continue
+
+        title = normalize_title(line)
+
+        if collecting_contents:
+            # Contents tables end at their first long line, or when an
+            # entry comes round again as the first heading.
+            if (
+                len(line) > MAX_TITLE_LENGTH
+                or title in contents_entries
+            ):
+                collecting_contents = False
+            else:
+                contents_entries.add(title)
+                # "Appendix--Scepticism of the Instrument" is headed
+                # just "APPENDIX" in the text.
+                contents_entries.add(
+                    re.split(r"--|:", title)[0].strip()
+                )
+
+        if not is_blank(index - 1):
+            continue
+
+        subtitle, end_line = find_subtitle(lines, index)
+
+        if match := CHAPTER_HEADING.match(line):
+            headings.append(
+                create_heading(
+                    "chapter",
+                    index,
+                    end_line,
+                    match.group("title") or subtitle or line,
+                    parse_number(match.group("number")),
+                )
+            )
+        elif not isolated:
+            continue
+        elif match := ROMAN_HEADING.match(line):
+            headings.append(
+                create_heading(
+                    "numeral",
+                    index,
+                    index + 1,
+                    line,
+                    parse_number(match.group("number")),
+                )
+            )
+        elif match := SECTION_HEADING.match(line):
+            headings.append(
+                create_heading(
+                    "section",
+                    index,
+                    index + 1,
+                    line,
+                    int(match.group("number")),
+                )
+            )
+        elif SCENE_BREAK.match(line):
+            headings.append(
+                create_heading("break", index, index + 1, None)
+            )
+        elif not collecting_contents and title in contents_entries:
+            headings.append(
+                create_heading("contents", index, index + 1, line)
+            )
+
+    return headings
+
+
+def select_headings(headings, line_offsets: List[int]):
+    """
+    The headings a book is split on: those of its highest level, less
+    contents listings, repeated title pages and empty chapters.
+    """
+    for kinds in LEVELS:
+        level = [h for h in headings if h["kind"] in kinds]
+        if level:
+            break
+    else:
+        return []
+
+    selected = []
+    last_numbers = {}
+
+    for heading in level:
+        number = heading["number"]
+        previous = last_numbers.get(heading["kind"])
+
+        if number is not None and previous is not None:
+            if number < previous:
+                # The numbering restarted: what came before was a
+                # listing, such as a contents table.
+                selected = [
+                    h for h in selected if h["kind"] != heading["kind"]
+                ]
+            elif number == previous:
+                # A heading repeated after its chapter's title page.
+                selected = [
+                    h
+                    for h in selected
+                    if h["kind"] != heading["kind"]
+                    or h["number"] != number
+                ]
+
+        if number is not None:
+            last_numbers[heading["kind"]] = number
+
+        selected.append(heading)
+
+    kept = []
+    next_offset = line_offsets[-1]
+
+    for heading in reversed(selected):
+        body = next_offset - line_offsets[heading["end_line"]]
+
+        if body >= MIN_CHAPTER_CHARS:
+            kept.append(heading)
+            next_offset = line_offsets[heading["line"]]
+
+    kept.reverse()
+    return kept
+
+
+def prefatory_id(kind: str) -> str:
+    kind = kind.lower()
+    return "acknowledgments" if kind.startswith("acknowledg") else kind
+
+
+def split_front_matter(lines: List[str], end: int):
+    """
+    Split the lines before the first chapter heading, `end`, into the
+    front matter and the chapters that come before chapter one.
+    """
+
+    def is_blank(index):
+        return index < 0 or index >= end or not lines[index].strip()
+
+    # Each part starts at a prefatory or contents heading. A chapter
+    # heading that was not selected (a half-title before chapter one)
+    # also ends a prefatory chapter.
+    starts = []
+    for index in range(end):
+        line = lines[index].strip()
+        if not (line and is_blank(index - 1)):
+            continue
+
+        in_prefatory = bool(starts) and starts[-1][1] is not None
+        if CHAPTER_HEADING.match(line) and in_prefatory:
+            starts.append((index, None))
+        elif not is_blank(index + 1):
+            continue
+        elif match := PREFATORY_HEADING.match(line):
+            starts.append((index, prefatory_id(match.group("kind"))))
+        elif CONTENTS_HEADING.match(line):
+            starts.append((index, None))
+
+    title_end = starts[0][0] if starts else end
+    title_block = "\n".join(lines[:title_end]).strip()
+
+    front_matter = []
+    chapters = []
+
+    # Prose under no heading: the first paragraph too long for a title
+    # page starts it.
+    paragraphs = (
+        re.split(r"\n\s*\n", title_block) if title_block else []
+    )
+    for position, paragraph in enumerate(paragraphs):
+        if len(paragraph) >= MIN_CHAPTER_CHARS:
+            title_block = "\n\n".join(paragraphs[:position]).strip()
+            chapters.append(
+                create_chapter(
+                    "opening",
+                    None,
+                    "\n\n".join(paragraphs[position:]).strip(),
+                )
+            )
+            break
+
+    front_matter.append(title_block)
+    title_lines = {
+        normalize_title(line) for line in title_block.splitlines()
+    }
+    ids = set()
+
+    for i, (start, chapter_id) in enumerate(starts):
+        stop = starts[i + 1][0] if i + 1 < len(starts) else end
+        body = "\n".join(lines[start + 1 : stop]).strip()
+
+        if chapter_id is None:
+            front_matter.append("\n".join(lines[start:stop]).strip())
+            continue
+
+        # A title page repeated before chapter one is not the preface's.
+        paragraphs = re.split(r"\n\s*\n", body)
+        while (
+            len(paragraphs) > 1
+            and normalize_title(paragraphs[-1]) in title_lines
+        ):
+            paragraphs.pop()
+        body = "\n\n".join(paragraphs)
+
+        unique_id = chapter_id
+        number = 2
+        while unique_id in ids:
+            unique_id = f"{chapter_id}{number}"
+            number += 1
+        ids.add(unique_id)
+
+        chapters.append(
+            create_chapter(unique_id, lines[start].strip(), body)
+        )
+
+    return "\n\n".join(part for part in front_matter if part), chapters
+
+
+def detect_chapters(text: str):
+    """
+    Split a book body into front matter and chapters.
+
+    Chapters are named chapter1, chapter2, ... when split on chapter
+    headings, contents titles or numerals, and section1, section2, ...
+    when only section markers or scene breaks were found, after any
+    prefatory chapters. A book with no headings at all is a single
+    chapter.
+    """
+    lines = [
+        line
+        for line in text.splitlines()
+        if not RESIDUE_LINE.match(line.strip())
+    ]
+
+    line_offsets = [0]
+    for line in lines:
+        line_offsets.append(line_offsets[-1] + len(line) + 1)
+
+    headings = select_headings(find_headings(lines), line_offsets)
+
+    def text_between(start, end):
+        return "\n".join(lines[start:end]).strip()
+
+    if not headings:
+        return {
+            "front_matter": "",
+            "chapters": [
+                create_chapter("chapter1", None, text_between(0, None))
+            ],
+        }
+
+    front_matter, chapters = split_front_matter(
+        lines, headings[0]["line"]
+    )
+    prefix = (
+        "section"
+        if headings[0]["kind"] in ("section", "break")
+        else "chapter"
+    )
+
+    for i, heading in enumerate(headings):
+        end = (
+            headings[i + 1]["line"]
+            if i + 1 < len(headings)
+            else len(lines)
+        )
+        chapters.append(
+            create_chapter(
+                f"{prefix}{i + 1}",
+                heading["title"],
+                text_between(heading["end_line"], end),
+            )
+        )
+
+    return {
+        "front_matter": front_matter,
+        "chapters": chapters,
+    }
@@ -1,42 +1,12 @@
-from os import getenv
-from urllib.parse import urlparse
+from database import check_health, close_pool
 
-from dotenv import load_dotenv
-import psycopg2
+health = check_health()
 
-load_dotenv()
+if health["ok"]:
+    print("Database connection successful!")
+    print(f"Round trip: {health['latency'] * 1000:.1f} ms")
+    print(f"Database version: {health['version']}")
+else:
+    print(f"Error connecting to database: {health['error']}")
 
-host = getenv("HOST")
-port = getenv("PORT")
-user = getenv("DATABASE_USER")
-password = getenv("PASSWORD")
-database = getenv("DATABASE")
-
-conn = psycopg2.connect(
-    host=host,
-    port=port,
-    user=user,
-    password=password,
-    database=database,
-)
-cur = conn.cursor()
-
-try:
-    cur.execute(
-        "SELECT 'Hello, Database World!' as message, version() as db_version;"
-    )
-    result = cur.fetchone()
-
-    if result:
-        print("Database connection successful!")
-        print(f"Message: {result[0]}")
-        print(f"Database version: {result[1]}")
-    else:
-        print("No results returned from database query")
-
-except Exception as e:
-    print(f"Error connecting to database: {e}")
-
-finally:
-    cur.close()
-    conn.close()
+close_pool()
@@ -0,0 +1,163 @@
+from itertools import product
+from typing import Iterable, List, Tuple
+
+from chunker import SentenceMatrix, create_chunking_config
+import numpy
+from spacy.tokens import Doc
+
+
+def create_config_grid(
+    thresholds: Iterable[float],
+    min_lens: Iterable[int],
+    max_lens: Iterable[int],
+):
+    """
+    Every combination of the given values, skipping those whose
+    `max_len` is below their `min_len`.
+    """
+    return [
+        create_chunking_config(
+            threshold=threshold,
+            min_len=min_len,
+            max_len=max_len,
+            vectorized=True,
+        )
+        for threshold, min_len, max_len in product(
+            thresholds,
+            min_lens,
+            max_lens,
+        )
+        if max_len >= min_len
+    ]
+
+
+def create_sweep_result(
+    config,
+    boundaries: List[Tuple[int, int]],
+    lengths: List[int],
+):
+    if lengths:
+        length_stats = {
+            "min": min(lengths),
+            "max": max(lengths),
+            "mean": float(numpy.mean(lengths)),
+            "median": float(numpy.median(lengths)),
+        }
+    else:
+        length_stats = {"min": 0, "max": 0, "mean": 0.0, "median": 0.0}
+
+    return {
+        "config": config,
+        "chunk_count": len(boundaries),
+        "boundaries": boundaries,
+        "lengths": lengths,
+        "length_stats": length_stats,
+    }
+
+
+def adjacent_similarities(matrix: SentenceMatrix) -> numpy.ndarray:
+    """
+    Cosine similarity of each sentence to the one before it.
+    """
+    if len(matrix) < 2:
+        return numpy.zeros(0)
+
+    dots = (matrix.vectors[1:] * matrix.vectors[:-1]).sum(axis=1)
+    denominators = matrix.norms[1:] * matrix.norms[:-1]
+
+    return numpy.divide(
+        dots,
+        denominators,
+        out=numpy.zeros_like(dots),
+        where=denominators != 0.0,
+    )
+
+
+def sweep_chunking_configs(doc: Doc, configs):
+    """
+    Chunk `doc` under every config in `configs` in a single pass.
+
+    The sentence matrix is built once, and at each sentence the
+    similarities against every config's open chunk are computed in one
+    vectorized step. Boundaries are exactly the ones a vectorized
+    SemanticChunker would produce for each config; thresholds and
+    lengths are taken from the configs, the `vectorized` flag is not.
+
+    Parse once and sweep as often as needed:
+
+        doc = chunker.parse(text)
+        grid = create_config_grid([0.8, 0.85, 0.9], [150, 250], [500])
+        sweep = sweep_chunking_configs(doc, grid)
+
+    Boundaries are (first, last) sentence indices, inclusive.
+    """
+    matrix = SentenceMatrix(doc)
+    sentence_count = len(matrix)
+    config_count = len(configs)
+
+    thresholds = numpy.array([c["threshold"] for c in configs])
+    min_lens = numpy.array([c["min_len"] for c in configs])
+    max_lens = numpy.array([c["max_len"] for c in configs])
+
+    boundaries = [[] for _ in configs]
+    lengths = [[] for _ in configs]
+
+    firsts = numpy.zeros(config_count, dtype="int64")
+    chunk_lengths = numpy.zeros(config_count, dtype="int64")
+
+    if sentence_count:
+        chunk_lengths[:] = matrix.text_lengths[0]
+
+    def close(config_index, last):
+        length = int(chunk_lengths[config_index])
+
+        if length >= min_lens[config_index]:
+            boundaries[config_index].append(
+                (int(firsts[config_index]), last)
+            )
+            lengths[config_index].append(length)
+
+    for index in range(1, sentence_count):
+        text_length = matrix.text_lengths[index]
+
+        if matrix.norms[index] == 0.0:
+            # Sentences without vectors are scored by spaCy, as in
+            # MatrixChunkBuilder.
+            sentence = matrix.sentences[index]
+            starts = [matrix.sentences[first].start for first in firsts]
+            sims = numpy.array(
+                [
+                    sentence.similarity(doc[start : sentence.start])
+                    for start in starts
+                ]
+            )
+        else:
+            sims = matrix.similarities(index, firsts, index)
+
+        keep = (sims >= thresholds) & (
+            chunk_lengths + text_length + 1 <= max_lens
+        )
+
+        for config_index in numpy.flatnonzero(~keep):
+            close(config_index, index - 1)
+
+        chunk_lengths[keep] += text_length + 1
+        chunk_lengths[~keep] = text_length
+        firsts[~keep] = index
+
+    if sentence_count:
+        for config_index in range(config_count):
+            close(config_index, sentence_count - 1)
+
+    return {
+        "sentence_count": sentence_count,
+        "adjacent_similarities": adjacent_similarities(matrix),
+        "results": [
+            create_sweep_result(
+                config=config,
+                boundaries=boundaries[i],
+                lengths=lengths[i],
+            )
+            for i, config in enumerate(configs)
+        ],
+    }
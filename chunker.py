@@ -1,20 +1,128 @@
-from typing import Any, Dict, List
-
-from books.a_crystal_age import chapter2
+from array import array
+import time
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from books import get_chapter
+from doc_cache import DocCache
+import numpy
 import spacy
 from spacy.language import Language
 from spacy.tokens import Doc, Span
 
 
+CHUNKING_MODEL = "en_core_web_md"
+
+# Components of the trained English pipelines that chunking never
+# reads: it only needs sentence boundaries and the word vectors, and
+# the vectors live in the vocab rather than in a component.
+UNUSED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+
+
+def load_chunking_model(
+    name: str = CHUNKING_MODEL,
+    use_senter: bool = False,
+) -> Language:
+    """
+    Load `name` with only the components chunking needs.
+
+    By default sentence boundaries come from the dependency parser,
+    which is what the full pipeline uses. With `use_senter` the parser
+    is excluded and the pipeline's `senter` component is enabled
+    instead. It is much faster but can place a few boundaries
+    differently, so run `compare_sentence_boundaries` on a sample of
+    chapters before switching a corpus over.
+    """
+    exclude = list(UNUSED_COMPONENTS)
+    exclude.append("parser" if use_senter else "senter")
+
+    try:
+        nlp = spacy.load(name, exclude=exclude)
+    except OSError:
+        raise RuntimeError(
+            f"spaCy model '{name}' not found. Please run: python -m spacy download {name}"
+        )
+
+    if use_senter:
+        nlp.enable_pipe("senter")
+
+    # The senter carries its own embedding layer, so the shared tok2vec
+    # is dead weight once nothing listens to it.
+    if (
+        "tok2vec" in nlp.pipe_names
+        and not nlp.get_pipe("tok2vec").listening_components
+    ):
+        nlp.remove_pipe("tok2vec")
+
+    return nlp
+
+
+def sentence_boundaries(doc: Doc) -> List[int]:
+    return [sent.start_char for sent in doc.sents]
+
+
+def compare_sentence_boundaries(
+    reference: Language,
+    candidate: Language,
+    texts: Iterable[str],
+):
+    """
+    Check that `candidate` splits `texts` into the same sentences as
+    `reference`, e.g. a senter profile against the parser profile:
+
+        compare_sentence_boundaries(
+            load_chunking_model(),
+            load_chunking_model(use_senter=True),
+            chapters,
+        )
+
+    Boundaries are compared as character offsets. The two profiles can
+    only produce different chunks where `mismatches` is non-empty, so
+    an `agreement` of 1.0 means they chunk identically.
+    """
+    matching = 0
+    total = 0
+    mismatches = []
+
+    for i, text in enumerate(texts):
+        expected = set(sentence_boundaries(reference(text)))
+        actual = set(sentence_boundaries(candidate(text)))
+
+        matching += len(expected & actual)
+        total += len(expected | actual)
+
+        for offset in sorted(expected ^ actual):
+            mismatches.append(
+                {
+                    "text": i,
+                    "offset": offset,
+                    "in_reference": offset in expected,
+                }
+            )
+
+    return {
+        "agreement": matching / total if total else 1.0,
+        "mismatches": mismatches,
+    }
+
+
 def create_chunking_config(
     threshold: float = 0.88,
     min_len: int = 250,
     max_len: int = 500,
+    vectorized: bool = False,
 ):
     return {
         "threshold": threshold,
         "min_len": min_len,
         "max_len": max_len,
+        "vectorized": vectorized,
     }
 
 
@@ -25,12 +133,133 @@ def create_chunk(content, sentences: List[Span]):
     }
 
 
+class ChunkRecord:
+    """
+    Compact, Doc-free description of a chunk: the book and chapter it
+    came from and the character offsets of its sentences, packed into
+    one array. The text is materialized from the chapter text on
+    demand, so records are small to hold and cheap to pickle.
+    """
+
+    __slots__ = ("book_id", "chapter_id", "sentence_bounds")
+
+    def __init__(
+        self,
+        book_id: Optional[str],
+        chapter_id: Optional[str],
+        sentence_bounds: array,
+    ):
+        self.book_id = book_id
+        self.chapter_id = chapter_id
+        self.sentence_bounds = sentence_bounds
+
+    @property
+    def start_char(self) -> int:
+        return self.sentence_bounds[0]
+
+    @property
+    def end_char(self) -> int:
+        return self.sentence_bounds[-1]
+
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentence_bounds) // 2
+
+    def sentence_offsets(self) -> List[Tuple[int, int]]:
+        bounds = self.sentence_bounds
+        return list(zip(bounds[::2], bounds[1::2]))
+
+    def sentences(self, source: str) -> List[str]:
+        return [
+            source[start:end] for start, end in self.sentence_offsets()
+        ]
+
+    def text(self, source: str) -> str:
+        """
+        The chunk content, identical to the `content` of the chunk the
+        record was made from.
+        """
+        return " ".join(self.sentences(source))
+
+    def __eq__(self, other):
+        if not isinstance(other, ChunkRecord):
+            return NotImplemented
+
+        return (
+            self.book_id == other.book_id
+            and self.chapter_id == other.chapter_id
+            and self.sentence_bounds == other.sentence_bounds
+        )
+
+    def __repr__(self):
+        return (
+            f"ChunkRecord({self.book_id!r}, {self.chapter_id!r}, "
+            f"{self.start_char}:{self.end_char}, "
+            f"sentences={self.sentence_count})"
+        )
+
+
+def to_chunk_record(
+    chunk,
+    book_id: Optional[str] = None,
+    chapter_id: Optional[str] = None,
+) -> ChunkRecord:
+    bounds = array("I")
+
+    for sentence in chunk["sentences"]:
+        bounds.append(sentence.start_char)
+        bounds.append(sentence.end_char)
+
+    return ChunkRecord(book_id, chapter_id, bounds)
+
+
+def create_chunking_result(
+    doc: Doc,
+    chunks,
+    sentence_count: int,
+    parse_seconds: float,
+    chunk_seconds: float,
+):
+    return {
+        "doc": doc,
+        "chunks": chunks,
+        "sentence_count": sentence_count,
+        "timings": {
+            "parse": parse_seconds,
+            "chunk": chunk_seconds,
+        },
+    }
+
+
 class ChunkBuilder:
+    """
+    Accumulates consecutive sentences into a chunk.
+
+    The text length and the token vector sum of the chunk are kept as
+    running totals, so checking a new sentence against the chunk costs
+    the same no matter how many sentences it already holds. The totals
+    are built token by token in document order, which is the same
+    order spaCy sums them in for `Span.vector`, so the similarity
+    scores match `Span.similarity` exactly.
+    """
+
     def __init__(self, context: Doc):
         self.doc = context
         self.sentences: List[Span] = []
+        self.text_length = 0
+        self.token_count = 0
+        self.vector_sum = 0
 
     def add_sentence(self, sentence: Span):
+        if self.sentences:
+            self.text_length += 1
+
+        self.text_length += len(sentence.text)
+        self.token_count += len(sentence)
+
+        for token in sentence:
+            self.vector_sum += token.vector
+
         self.sentences.append(sentence)
 
     def can_accommodate(
@@ -41,7 +270,7 @@ class ChunkBuilder:
         if not self.sentences:
             return True
 
-        newlen = len(self.to_text()) + len(sentence.text) + 1
+        newlen = self.text_length + len(sentence.text) + 1
 
         return newlen <= max_length
 
@@ -57,9 +286,32 @@ class ChunkBuilder:
         if not self.sentences:
             return True
 
-        sim = sentence.similarity(self.as_span())
+        # spaCy short-circuits spans of equal length with identical
+        # tokens, and lets hooks override the vectors entirely; leave
+        # both cases to spaCy itself.
+        if (
+            self.doc.user_span_hooks
+            or len(sentence) == self.token_count
+        ):
+            sim = sentence.similarity(self.as_span())
+            return sim >= threshold
+
+        sim = self.similarity_to_centroid(sentence)
         return sim >= threshold
 
+    def similarity_to_centroid(self, sentence: Span) -> float:
+        centroid = self.vector_sum / self.token_count
+        total = (centroid * centroid).sum()
+        centroid_norm = numpy.sqrt(total) if total != 0.0 else 0.0
+
+        if sentence.vector_norm == 0.0 or centroid_norm == 0.0:
+            return 0.0
+
+        result = numpy.dot(sentence.vector, centroid) / (
+            sentence.vector_norm * centroid_norm
+        )
+        return result.item()
+
     def as_span(self) -> Span:
         start = self.sentences[0].start
         end = self.sentences[-1].end
@@ -72,6 +324,168 @@ class ChunkBuilder:
 
     def clear(self):
         self.sentences = []
+        self.text_length = 0
+        self.token_count = 0
+        self.vector_sum = 0
+
+
+def token_vector_matrix(doc: Doc) -> numpy.ndarray:
+    """
+    Stack the vectors of every token in `doc` into one array, using a
+    single lookup into the vectors table where the vectors allow it.
+    """
+    vectors = doc.vocab.vectors
+
+    if not len(doc):
+        return numpy.zeros((0, doc.vocab.vectors_length), dtype="f")
+
+    if (
+        vectors.mode != "default"
+        or vectors.size == 0
+        or doc.user_token_hooks
+    ):
+        return numpy.array([token.vector for token in doc], dtype="f")
+
+    rows = vectors.find(keys=doc.to_array(vectors.attr))
+    matrix = vectors.data[rows]
+    matrix[rows < 0] = 0.0
+    return matrix
+
+
+class SentenceMatrix:
+    """
+    Sentence vectors of a Doc, extracted once into NumPy arrays.
+
+    Sentence norms are precomputed, and the centroid of any run of
+    consecutive sentences is read off cumulative sums over the sentence
+    rows, so scoring a sentence against a chunk is a few vector
+    operations regardless of chunk size.
+    """
+
+    def __init__(self, doc: Doc):
+        self.doc = doc
+        self.sentences: List[Span] = list(doc.sents)
+        self.index = {
+            sentence.start: i
+            for i, sentence in enumerate(self.sentences)
+        }
+        self.text_lengths = [len(sent.text) for sent in self.sentences]
+        self.token_counts = numpy.array(
+            [len(sent) for sent in self.sentences],
+            dtype="int64",
+        )
+
+        tokens = token_vector_matrix(doc)
+
+        if self.sentences:
+            starts = [sent.start for sent in self.sentences]
+            sums = numpy.add.reduceat(
+                tokens,
+                starts,
+                axis=0,
+                dtype="float64",
+            )
+        else:
+            sums = numpy.zeros((0, tokens.shape[1]))
+
+        self.vectors = sums / self.token_counts[:, None]
+        self.norms = numpy.sqrt(
+            (self.vectors * self.vectors).sum(axis=1)
+        )
+
+        self.cumulative_sums = numpy.zeros(
+            (len(sums) + 1, sums.shape[1])
+        )
+        numpy.cumsum(sums, axis=0, out=self.cumulative_sums[1:])
+        self.cumulative_counts = numpy.zeros(
+            len(sums) + 1, dtype="int64"
+        )
+        numpy.cumsum(self.token_counts, out=self.cumulative_counts[1:])
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def similarities(
+        self,
+        index: int,
+        firsts: numpy.ndarray,
+        end: int,
+    ) -> numpy.ndarray:
+        """
+        Cosine similarities between sentence `index` and the centroids
+        of sentences `firsts[k]` up to (not including) `end`, one per
+        entry of `firsts`. A zero vector on either side scores 0.0.
+        """
+        totals = (
+            self.cumulative_sums[end] - self.cumulative_sums[firsts]
+        )
+        counts = (
+            self.cumulative_counts[end] - self.cumulative_counts[firsts]
+        )
+        centroids = totals / counts[:, None]
+        centroid_norms = numpy.sqrt((centroids * centroids).sum(axis=1))
+
+        dots = (centroids * self.vectors[index]).sum(axis=1)
+        denominators = self.norms[index] * centroid_norms
+
+        return numpy.divide(
+            dots,
+            denominators,
+            out=numpy.zeros_like(dots),
+            where=denominators != 0.0,
+        )
+
+    def similarity(self, index: int, first: int, last: int) -> float:
+        """
+        Cosine similarity between sentence `index` and the centroid of
+        sentences `first` through `last`.
+        """
+        firsts = numpy.array([first])
+        return float(self.similarities(index, firsts, last + 1)[0])
+
+
+class MatrixChunkBuilder(ChunkBuilder):
+    """
+    ChunkBuilder that scores sentences against a SentenceMatrix instead
+    of summing token vectors. Sentences without any vectors are left to
+    `Span.similarity`.
+    """
+
+    def __init__(self, context: Doc, matrix: SentenceMatrix):
+        super().__init__(context)
+        self.matrix = matrix
+        self.first = 0
+        self.last = 0
+
+    def add_sentence(self, sentence: Span):
+        index = self.matrix.index[sentence.start]
+
+        if self.sentences:
+            self.text_length += 1
+        else:
+            self.first = index
+
+        self.last = index
+        self.text_length += self.matrix.text_lengths[index]
+        self.token_count += int(self.matrix.token_counts[index])
+        self.sentences.append(sentence)
+
+    def is_similar_to(
+        self,
+        sentence: Span,
+        threshold,
+    ):
+        if not self.sentences:
+            return True
+
+        index = self.matrix.index[sentence.start]
+
+        if self.matrix.norms[index] == 0.0:
+            sim = sentence.similarity(self.as_span())
+        else:
+            sim = self.matrix.similarity(index, self.first, self.last)
+
+        return sim >= threshold
 
 
 class SemanticChunker:
@@ -79,25 +493,151 @@ class SemanticChunker:
         self,
         nlp_model: Language,
         config,
+        doc_cache: Optional[DocCache] = None,
     ):
         self.nlp = nlp_model
         self.config = config
+        self.doc_cache = doc_cache
+
+    def create_builder(self, doc: Doc) -> ChunkBuilder:
+        if self.config["vectorized"]:
+            return MatrixChunkBuilder(
+                context=doc,
+                matrix=SentenceMatrix(doc),
+            )
+
+        return ChunkBuilder(context=doc)
+
+    def parse(self, text) -> Doc:
+        if self.doc_cache is None:
+            return self.nlp(text)
+
+        return self.doc_cache.parse(self.nlp, text)
 
     def process(self, text):
-        doc = self.nlp(text)
-        builder = ChunkBuilder(context=doc)
+        return self.chunk_doc(self.parse(text))
+
+    def run(self, text, as_records: bool = False):
+        """
+        Chunk `text` and return the chunks along with the parsed Doc,
+        its sentence count and how long parsing and chunking took, so
+        callers can report on a chapter without parsing it again.
+        `as_records` works as in `iter_chunks`.
+        """
+        started = time.perf_counter()
+        doc = self.parse(text)
+        parsed = time.perf_counter()
+        chunks = list(self.iter_doc_chunks(doc, as_records))
+        finished = time.perf_counter()
+
+        return create_chunking_result(
+            doc=doc,
+            chunks=chunks,
+            sentence_count=sum(1 for _ in doc.sents),
+            parse_seconds=parsed - started,
+            chunk_seconds=finished - parsed,
+        )
+
+    def process_many(
+        self,
+        records: Iterable[Tuple[str, str, str]],
+        batch_size: int = 4,
+        n_process: int = 1,
+        as_records: bool = False,
+    ) -> Iterator[Tuple[str, str, Any]]:
+        """
+        Chunk a stream of (book, chapter, text) records.
+
+        Texts are parsed with `nlp.pipe`, `batch_size` chapters at a
+        time and spread over `n_process` worker processes; with a
+        `doc_cache`, only texts missing from the cache are parsed.
+        Chunks are yielded as (book, chapter, chunk) tuples, in record
+        order, as soon as each one is completed; `as_records` works as
+        in `iter_chunks`.
+        """
+        tuples = (
+            (text, (book, chapter)) for book, chapter, text in records
+        )
+
+        if self.doc_cache is None:
+            docs = self.nlp.pipe(
+                tuples,
+                as_tuples=True,
+                batch_size=batch_size,
+                n_process=n_process,
+            )
+        else:
+            docs = self.doc_cache.pipe(
+                self.nlp,
+                tuples,
+                batch_size=batch_size,
+                n_process=n_process,
+            )
 
-        chunks = []
+        for doc, (book, chapter) in docs:
+            for chunk in self.iter_doc_chunks(
+                doc,
+                as_records,
+                book,
+                chapter,
+            ):
+                yield book, chapter, chunk
+
+    def chunk_doc(self, doc: Doc):
+        return list(self.iter_doc_chunks(doc))
+
+    def iter_chunks(
+        self,
+        text,
+        as_records: bool = False,
+        book_id: Optional[str] = None,
+        chapter_id: Optional[str] = None,
+    ):
+        """
+        Generator version of `process`: each chunk is yielded as soon
+        as it is completed instead of after the whole text is chunked.
+
+        With `as_records`, chunks are yielded as ChunkRecords tagged
+        with `book_id` and `chapter_id` rather than as Spans, so
+        nothing the caller keeps holds on to the Doc.
+        """
+        return self.iter_doc_chunks(
+            self.parse(text),
+            as_records,
+            book_id,
+            chapter_id,
+        )
+
+    def iter_doc_chunks(
+        self,
+        doc: Doc,
+        as_records: bool = False,
+        book_id: Optional[str] = None,
+        chapter_id: Optional[str] = None,
+    ):
+        builder = self.create_builder(doc)
+
+        completed = []
+
+        def release():
+            for chunk in completed:
+                if as_records:
+                    yield to_chunk_record(chunk, book_id, chapter_id)
+                else:
+                    yield chunk
+
+            completed.clear()
 
         for sentence in doc.sents:
             self.process_sentence(
                 sentence,
                 builder,
-                chunks,
+                completed,
             )
+            yield from release()
 
-        self.finalize_chunks(builder, chunks)
-        return chunks
+        self.finalize_chunks(builder, completed)
+        yield from release()
 
     def process_sentence(
         self,
@@ -161,12 +701,7 @@ class SemanticChunker:
 
 
 if __name__ == "__main__":
-    try:
-        nlp = spacy.load("en_core_web_md")
-    except OSError:
-        raise RuntimeError(
-            "spaCy model 'en_core_web_md' not found. Please run: python -m spacy download en_core_web_md"
-        )
+    nlp = load_chunking_model()
 
     config = create_chunking_config(
         threshold=0.88,
@@ -175,7 +710,7 @@ if __name__ == "__main__":
     )
 
     chunker = SemanticChunker(nlp_model=nlp, config=config)
-    chunks = chunker.process(chapter2)
+    result = chunker.run(get_chapter("a_crystal_age", "chapter2"))
 
-    doc = nlp(chapter2)
-    sentences = list(doc.sents)
+    chunks = result["chunks"]
+    sentences = list(result["doc"].sents)
@@ -0,0 +1,213 @@
+"""
+Bulk loading of chunks into the `corpus` table.
+
+Rows are streamed to Postgres with `COPY corpus (...) FROM STDIN`
+instead of one INSERT per chunk. Each book is loaded in its own
+transaction, so a failure part way through leaves the books before it
+loaded and none of the failed book's chunks behind. Within a book,
+rows are sent in batches of `batch_size`, each batch one COPY.
+
+The binary COPY format is used by default: embeddings go over the
+wire as pgvector's binary representation (uint16 dimensions, uint16
+unused, then big-endian float4s) rather than as text that the server
+has to parse. Pass `binary=False` for the text format, e.g. for an
+older pgvector without binary input.
+
+Rows must be grouped by book, as the chunker produces them. When
+`corpus` is partitioned, a book's partition is created, if missing, in
+the transaction that loads it; an unpartitioned corpus (the original
+docs/schema.sql table) is loaded as it is.
+"""
+
+from itertools import groupby, islice
+import io
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from database import vector_literal
+import numpy as np
+from partitions import ensure_partition, is_partitioned
+
+EMBEDDING_DIMENSIONS = {
+    "nomic_embeddings": 768,
+    "mxb_embeddings": 1024,
+    "bge_embeddings": 1024,
+}
+
+EMBEDDING_COLUMNS = tuple(EMBEDDING_DIMENSIONS)
+
+CORPUS_COLUMNS = (
+    "book_title",
+    "chapter_title",
+    "chunk_sequence",
+    "chunk_text",
+) + EMBEDDING_COLUMNS
+
+DEFAULT_BATCH_SIZE = 1000
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = COPY_SIGNATURE + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+FIELD_COUNT = struct.Struct(">h")
+FIELD_LENGTH = struct.Struct(">i")
+INT4 = struct.Struct(">i")
+VECTOR_HEADER = struct.Struct(">HH")
+
+NULL_FIELD = FIELD_LENGTH.pack(-1)
+
+
+def create_corpus_row(
+    book_title: str,
+    chapter_title: Optional[str],
+    chunk_sequence: int,
+    chunk_text: str,
+    nomic_embeddings: Optional[Sequence[float]] = None,
+    mxb_embeddings: Optional[Sequence[float]] = None,
+    bge_embeddings: Optional[Sequence[float]] = None,
+):
+    return {
+        "book_title": book_title,
+        "chapter_title": chapter_title,
+        "chunk_sequence": chunk_sequence,
+        "chunk_text": chunk_text,
+        "nomic_embeddings": nomic_embeddings,
+        "mxb_embeddings": mxb_embeddings,
+        "bge_embeddings": bge_embeddings,
+    }
+
+
+def batched(rows: Iterable, size: int) -> Iterator[List]:
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def binary_field(data: Optional[bytes]) -> bytes:
+    if data is None:
+        return NULL_FIELD
+    return FIELD_LENGTH.pack(len(data)) + data
+
+
+def binary_text(value: Optional[str]) -> Optional[bytes]:
+    return None if value is None else value.encode("utf-8")
+
+
+def binary_vector(values: Optional[Sequence[float]]) -> Optional[bytes]:
+    if values is None:
+        return None
+
+    vector = np.asarray(values, dtype=">f4")
+    return VECTOR_HEADER.pack(len(vector), 0) + vector.tobytes()
+
+
+def encode_binary_row(row) -> bytes:
+    fields = [
+        binary_text(row["book_title"]),
+        binary_text(row["chapter_title"]),
+        INT4.pack(row["chunk_sequence"]),
+        binary_text(row["chunk_text"]),
+    ]
+    fields.extend(
+        binary_vector(row[column]) for column in EMBEDDING_COLUMNS
+    )
+
+    return FIELD_COUNT.pack(len(fields)) + b"".join(
+        binary_field(field) for field in fields
+    )
+
+
+def encode_binary_batch(rows: Iterable) -> bytes:
+    return (
+        COPY_HEADER
+        + b"".join(encode_binary_row(row) for row in rows)
+        + COPY_TRAILER
+    )
+
+
+TEXT_ESCAPES = str.maketrans(
+    {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+)
+
+
+def text_field(value) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).translate(TEXT_ESCAPES)
+
+
+def text_vector(values: Optional[Sequence[float]]) -> str:
+    if values is None:
+        return "\\N"
+    return vector_literal(values)
+
+
+def encode_text_row(row) -> str:
+    fields = [
+        text_field(row["book_title"]),
+        text_field(row["chapter_title"]),
+        text_field(row["chunk_sequence"]),
+        text_field(row["chunk_text"]),
+    ]
+    fields.extend(
+        text_vector(row[column]) for column in EMBEDDING_COLUMNS
+    )
+
+    return "\t".join(fields) + "\n"
+
+
+def encode_text_batch(rows: Iterable) -> bytes:
+    return "".join(encode_text_row(row) for row in rows).encode("utf-8")
+
+
+def copy_statement(binary: bool) -> str:
+    columns = ", ".join(CORPUS_COLUMNS)
+    options = " WITH (FORMAT binary)" if binary else ""
+    return f"COPY corpus ({columns}) FROM STDIN{options}"
+
+
+def load_corpus(
+    connection,
+    rows: Iterable,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    binary: bool = True,
+) -> Dict[str, int]:
+    """
+    COPY `rows` (dicts from `create_corpus_row`) into `corpus`, one
+    transaction per book. Returns the number of rows loaded per book.
+    """
+    statement = copy_statement(binary)
+    encode_batch = encode_binary_batch if binary else encode_text_batch
+    loaded = {}
+
+    with connection:
+        with connection.cursor() as cursor:
+            partitioned = is_partitioned(cursor)
+
+    for book_title, book_rows in groupby(
+        rows, key=lambda row: row["book_title"]
+    ):
+        if book_title in loaded:
+            raise ValueError(
+                f"Rows for {book_title!r} are not contiguous; "
+                "sort them by book before loading"
+            )
+
+        count = 0
+
+        # The connection's context manager commits the book on success
+        # and rolls the whole book back on any error.
+        with connection:
+            with connection.cursor() as cursor:
+                if partitioned:
+                    ensure_partition(cursor, book_title)
+
+                for batch in batched(book_rows, batch_size):
+                    cursor.copy_expert(
+                        statement, io.BytesIO(encode_batch(batch))
+                    )
+                    count += len(batch)
+
+        loaded[book_title] = count
+
+    return loaded
@@ -0,0 +1,172 @@
+"""
+Memory-mapped copy of the corpus.
+
+`build_corpus_store` writes every chapter in the registry into one
+UTF-8 blob, plus a binary index of (book, chapter, byte start, byte
+end). `CorpusStore` maps the blob read-only and decodes a chapter
+only when it is asked for, so any number of processes reading the
+corpus share a single page-cache copy of the text instead of each
+holding every chapter as a Python string. `books.get_chapter` reads
+from it whenever it was built from the current `books/manifest.json`.
+
+Index layout, little-endian: the magic bytes, the hash of the
+manifest the store was built from, an entry count, then per entry
+the book id and chapter id, followed by the uint64 start and end
+offsets into the blob. Strings are a uint16 length and UTF-8 bytes.
+"""
+
+import mmap
+import os
+from pathlib import Path
+import struct
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import books
+
+DEFAULT_STORE_DIR = Path(__file__).parent / "data"
+BLOB_NAME = "corpus.bin"
+INDEX_NAME = "corpus.idx"
+
+INDEX_MAGIC = b"UTOPIDX2"
+COUNT = struct.Struct("<I")
+NAME_LENGTH = struct.Struct("<H")
+OFFSETS = struct.Struct("<QQ")
+
+
+def write_atomically(path: Path, data: bytes):
+    partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    partial.write_bytes(data)
+    os.replace(partial, path)
+
+
+def pack_name(name: str) -> bytes:
+    encoded = name.encode("utf-8")
+    return NAME_LENGTH.pack(len(encoded)) + encoded
+
+
+def build_corpus_store(
+    directory: Path = DEFAULT_STORE_DIR,
+    records: Optional[Iterable[Tuple[str, str, str]]] = None,
+):
+    """
+    Write `records` ((book, chapter, text) tuples, the whole registry
+    by default) to `directory` as a blob and its index, marked as
+    built from the current manifest.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    if records is None:
+        # Not through the store being replaced.
+        records = books.iter_chapters(from_modules=True)
+
+    blob = bytearray()
+    entries = []
+
+    for book_id, chapter_id, text in records:
+        start = len(blob)
+        blob += text.encode("utf-8")
+        entries.append(
+            pack_name(book_id)
+            + pack_name(chapter_id)
+            + OFFSETS.pack(start, len(blob))
+        )
+
+    index = (
+        INDEX_MAGIC
+        + pack_name(books.manifest_hash())
+        + COUNT.pack(len(entries))
+        + b"".join(entries)
+    )
+
+    # The blob goes first: a reader that sees the new index must
+    # also see the blob it points into.
+    write_atomically(directory / BLOB_NAME, bytes(blob))
+    write_atomically(directory / INDEX_NAME, index)
+    books.load_store.cache_clear()
+
+
+def read_index(
+    data: bytes,
+) -> Tuple[str, Dict[Tuple[str, str], Tuple[int, int]]]:
+    """
+    The manifest hash and the entries of a corpus index.
+    """
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError("Not a corpus index")
+
+    position = len(INDEX_MAGIC)
+
+    def read_name():
+        nonlocal position
+        (length,) = NAME_LENGTH.unpack_from(data, position)
+        position += NAME_LENGTH.size
+        name = data[position : position + length].decode("utf-8")
+        position += length
+        return name
+
+    manifest_hash = read_name()
+    (count,) = COUNT.unpack_from(data, position)
+    position += COUNT.size
+
+    index = {}
+
+    for _ in range(count):
+        book_id = read_name()
+        chapter_id = read_name()
+        index[book_id, chapter_id] = OFFSETS.unpack_from(data, position)
+        position += OFFSETS.size
+
+    return manifest_hash, index
+
+
+class CorpusStore:
+    def __init__(self, directory: Path = DEFAULT_STORE_DIR):
+        directory = Path(directory)
+        self.manifest_hash, self.index = read_index(
+            (directory / INDEX_NAME).read_bytes()
+        )
+
+        with open(directory / BLOB_NAME, "rb") as f:
+            # An empty file cannot be mapped.
+            if os.fstat(f.fileno()).st_size:
+                self.blob = mmap.mmap(
+                    f.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ,
+                )
+            else:
+                self.blob = b""
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def chapter_bytes(
+        self, book_id: str, chapter_id: str
+    ) -> memoryview:
+        """
+        Zero-copy view of a chapter's UTF-8 bytes in the mapped blob.
+        """
+        start, end = self.index[book_id, chapter_id]
+        return memoryview(self.blob)[start:end]
+
+    def chapter(self, book_id: str, chapter_id: str) -> str:
+        start, end = self.index[book_id, chapter_id]
+        return self.blob[start:end].decode("utf-8")
+
+    def iter_chapters(self) -> Iterator[Tuple[str, str, str]]:
+        for book_id, chapter_id in self.index:
+            yield book_id, chapter_id, self.chapter(book_id, chapter_id)
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+
+
+if __name__ == "__main__":
+    build_corpus_store()
+    store = CorpusStore()
+    print(f"Wrote {len(store)} chapters to {DEFAULT_STORE_DIR}")
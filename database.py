@@ -0,0 +1,235 @@
+"""
+Pooled access to the Postgres database.
+
+One `ThreadedConnectionPool` is shared by every thread in the process
+(each Streamlit session runs on its own thread), created on first use
+from the same settings `check_db.py` always read from the environment
+or `.env`. Its size comes from DB_POOL_MIN and DB_POOL_MAX. When all
+DB_POOL_MAX connections are in use, callers wait up to DB_POOL_TIMEOUT
+seconds for one to be returned rather than failing at once.
+
+    with cursor() as cur:
+        cur.execute("SELECT count(*) FROM corpus")
+
+`cursor` commits when its block finishes and rolls back if it raises.
+A connection that broke while in use is closed rather than returned
+to the pool.
+
+Pooled connections remember the statements prepared on them, so a
+query run on every request is parsed and planned once per connection
+(see `prepare`). Query embeddings are passed to them as `Vector`,
+which is sent as a compact pgvector literal.
+"""
+
+from contextlib import contextmanager
+from os import getenv
+import threading
+import time
+
+from dotenv import load_dotenv
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import AsIs, register_adapter
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+load_dotenv()
+
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 10
+DEFAULT_POOL_TIMEOUT = 30.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_params():
+    return {
+        "host": getenv("HOST"),
+        "port": getenv("PORT"),
+        "user": getenv("DATABASE_USER"),
+        "password": getenv("PASSWORD"),
+        "database": getenv("DATABASE"),
+    }
+
+
+def pool_size():
+    minconn = int(getenv("DB_POOL_MIN", DEFAULT_POOL_MIN))
+    maxconn = int(getenv("DB_POOL_MAX", DEFAULT_POOL_MAX))
+    return minconn, max(minconn, maxconn)
+
+
+def pool_timeout() -> float:
+    return float(getenv("DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT))
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    A connection that tracks the names of the statements prepared on
+    it. Prepared statements live as long as the server session, so the
+    set is never cleared; a replacement connection starts empty.
+
+    It also caches how corpus is partitioned, as (partitioned, title to
+    partition), for routing filtered searches (see `search.py`); None
+    until first needed, and again after a partition is created on it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.partitions = None
+
+
+class Vector:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+
+def vector_literal(values) -> str:
+    # Nine significant digits round-trip every float4 exactly.
+    vector = np.asarray(values, dtype=np.float32).tolist()
+    return "[" + ",".join(map("{:.9g}".format, vector)) + "]"
+
+
+def adapt_vector(vector: Vector):
+    return AsIs(f"'{vector_literal(vector.values)}'::vector")
+
+
+register_adapter(Vector, adapt_vector)
+
+
+class WaitingConnectionPool(ThreadedConnectionPool):
+    """
+    A pool with one slot per connection it may open, for callers to
+    wait on: ThreadedConnectionPool raises instead of waiting when it
+    has none left. The slots are made with the pool, so no thread can
+    see one without the other.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+
+def get_pool() -> WaitingConnectionPool:
+    global _pool
+
+    # Checked again under the lock so that threads racing on first
+    # use create only one pool.
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                minconn, maxconn = pool_size()
+                _pool = WaitingConnectionPool(
+                    minconn,
+                    maxconn,
+                    connection_factory=PreparingConnection,
+                    **connection_params(),
+                )
+
+    return _pool
+
+
+def close_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            # Unpublished first, so new callers get a fresh pool.
+            pool, _pool = _pool, None
+            pool.closeall()
+
+
+def connect():
+    """
+    A connection outside the pool, for long-running work such as bulk
+    loads and index builds that should not hold a pooled slot.
+    """
+    return psycopg2.connect(**connection_params())
+
+
+@contextmanager
+def connection():
+    pool = get_pool()
+    if not pool.slots.acquire(timeout=pool_timeout()):
+        raise PoolError("Timed out waiting for a pooled connection")
+
+    try:
+        if pool.closed:
+            raise PoolError("The connection pool was closed")
+        conn = pool.getconn()
+    except BaseException:
+        pool.slots.release()
+        raise
+
+    broken = False
+
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        try:
+            # closeall has already closed it if the pool was closed.
+            if not pool.closed:
+                if not broken and not conn.closed:
+                    # Never hand the next user a connection
+                    # mid-transaction.
+                    conn.rollback()
+                pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            pool.slots.release()
+
+
+@contextmanager
+def cursor():
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                yield cur
+
+
+def prepare(cur, name: str, statement: sql.Composable):
+    """
+    PREPARE `statement` as `name` on the cursor's connection, unless
+    it already is. The statement uses $1, $2, ... for its parameters
+    and is then run with `EXECUTE name (...)`.
+    """
+    conn = cur.connection
+
+    if name not in conn.prepared:
+        cur.execute(
+            sql.SQL("PREPARE {} AS ").format(sql.Identifier(name))
+            + statement
+        )
+        conn.prepared.add(name)
+
+
+def check_health():
+    """
+    Round-trip a trivial query through the pool. Returns whether it
+    worked, how long it took, and the server version or the error.
+    """
+    started = time.perf_counter()
+
+    try:
+        with cursor() as cur:
+            cur.execute("SELECT version()")
+            (version,) = cur.fetchone()
+    except psycopg2.Error as e:
+        return {
+            "ok": False,
+            "latency": time.perf_counter() - started,
+            "version": None,
+            "error": str(e),
+        }
+
+    return {
+        "ok": True,
+        "latency": time.perf_counter() - started,
+        "version": version,
+        "error": None,
+    }
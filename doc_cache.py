@@ -0,0 +1,164 @@
+from collections import deque
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin
+
+DEFAULT_CACHE_DIR = ".cache/docs"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class DocCache:
+    """
+    On-disk cache of parsed Docs, one serialized DocBin per text.
+
+    Entries are keyed by the SHA-256 of the text together with the
+    model name, model version and the enabled pipeline components, so
+    a different model or loading profile never reads another's parses.
+
+    Only tokens and sentence boundaries are stored, which is all the
+    chunker reads: word vectors come back from the vocab of the model
+    the Doc is restored into. Doc tensors are not kept.
+
+    The directory is kept under `max_bytes` by evicting the least
+    recently used entries; reading an entry refreshes its mtime.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, nlp: Language, text: str) -> str:
+        identity = json.dumps(
+            [
+                hashlib.sha256(text.encode("utf-8")).hexdigest(),
+                nlp.meta.get("lang"),
+                nlp.meta.get("name"),
+                nlp.meta.get("version"),
+                nlp.pipe_names,
+            ]
+        )
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def path(self, nlp: Language, text: str) -> Path:
+        return self.directory / f"{self.key(nlp, text)}.spacy"
+
+    def contains(self, nlp: Language, text: str) -> bool:
+        return self.path(nlp, text).exists()
+
+    def get(self, nlp: Language, text: str) -> Optional[Doc]:
+        path = self.path(nlp, text)
+
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since it was read; the bytes are still good.
+            pass
+
+        doc_bin = DocBin().from_bytes(data)
+        return next(doc_bin.get_docs(nlp.vocab))
+
+    def put(self, nlp: Language, text: str, doc: Doc):
+        doc_bin = DocBin(attrs=["SENT_START"], docs=[doc])
+
+        path = self.path(nlp, text)
+        # A unique temporary file per writer: threads of one process
+        # (Streamlit sessions) may store the same text at once.
+        fd, partial = tempfile.mkstemp(
+            dir=self.directory, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(doc_bin.to_bytes())
+            os.replace(partial, path)
+        except BaseException:
+            Path(partial).unlink(missing_ok=True)
+            raise
+
+        self.evict()
+
+    def parse(self, nlp: Language, text: str) -> Doc:
+        doc = self.get(nlp, text)
+
+        if doc is None:
+            doc = nlp(text)
+            self.put(nlp, text, doc)
+
+        return doc
+
+    def pipe(
+        self,
+        nlp: Language,
+        tuples: Iterable[Tuple[str, Any]],
+        batch_size: int = 4,
+        n_process: int = 1,
+    ) -> Iterator[Tuple[Doc, Any]]:
+        """
+        Cached counterpart of `nlp.pipe(tuples, as_tuples=True)`.
+
+        Texts missing from the cache are streamed through a single
+        `nlp.pipe` call and stored as they come back; cached texts are
+        read when their turn comes. Results keep the input order.
+        """
+        pending = deque()
+
+        def misses():
+            for text, context in tuples:
+                cached = self.contains(nlp, text)
+                pending.append((text, context, cached))
+
+                if not cached:
+                    yield text
+
+        def cached_docs():
+            while pending and pending[0][2]:
+                text, context, _ = pending.popleft()
+                yield self.parse(nlp, text), context
+
+        parsed = nlp.pipe(
+            misses(),
+            batch_size=batch_size,
+            n_process=n_process,
+        )
+
+        for doc in parsed:
+            yield from cached_docs()
+
+            text, context, _ = pending.popleft()
+            self.put(nlp, text, doc)
+            yield doc, context
+
+        yield from cached_docs()
+
+    def evict(self):
+        entries = []
+        for entry in self.directory.glob("*.spacy"):
+            try:
+                entries.append((entry.stat(), entry))
+            except FileNotFoundError:
+                # Another thread evicted it meanwhile.
+                continue
+
+        total = sum(stat.st_size for stat, _ in entries)
+
+        for stat, entry in sorted(entries, key=lambda e: e[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+
+            entry.unlink(missing_ok=True)
+            total -= stat.st_size
@@ -1,10 +1,19 @@
+-- One partition per book, named corpus_<slug of book_title>. The loader
+-- creates each with:
+--   CREATE TABLE corpus_news_from_nowhere PARTITION OF corpus
+--       FOR VALUES IN ('News from Nowhere');
 CREATE TABLE corpus (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     book_title VARCHAR(255) NOT NULL,
     chapter_title VARCHAR(255),
     chunk_sequence INT NOT NULL,
     chunk_text TEXT NOT NULL,
+    chunk_tsv TSVECTOR GENERATED ALWAYS AS
+        (to_tsvector('english', chunk_text)) STORED,
     nomic_embeddings VECTOR(768),
     mxb_embeddings VECTOR(1024),
-    bge_embeddings VECTOR(1024)
-);
+    bge_embeddings VECTOR(1024),
+    PRIMARY KEY (id, book_title)
+) PARTITION BY LIST (book_title);
+
+CREATE INDEX corpus_chunk_tsv_idx ON corpus USING GIN (chunk_tsv);
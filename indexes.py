@@ -0,0 +1,286 @@
+"""
+Approximate nearest-neighbour indexes on the corpus embeddings.
+
+Creates one pgvector index per embedding column, HNSW by default or
+IVFFlat, for cosine distance (the `<=>` operator `search.py` orders
+by). Indexes are built CONCURRENTLY so the table stays readable while
+they build, and are named after their column and method, so running
+the migration again is a no-op and the two methods can coexist while
+they are compared.
+
+    python indexes.py                          # HNSW on every column
+    python indexes.py --m 24 --ef-construction 128
+    python indexes.py --method ivfflat --lists 200
+    python indexes.py --method ivfflat --drop
+    python indexes.py --text-search            # chunk_tsv and its index
+    python indexes.py --quantization binary    # see below
+
+Quantized indexes index an expression of the column rather than the
+column: its halfvec cast (half the size of a vector index) or its
+binary_quantize bits compared by Hamming distance (a 32nd of the
+size). The column itself stays full precision, so search.py's
+`quantization` option walks the small index and then reranks its
+candidates by exact distance on the stored vectors.
+
+Only the ANN index shrinks: the corpus table keeps its full-precision
+vector columns, which the rerank reads, and is exactly as large as
+before. A quantized index is built alongside the plain one, not in
+place of it; drop the plain index to reclaim its space.
+
+IVFFlat builds its lists from the rows present, so create it after
+loading the corpus and rebuild it when the corpus grows.
+
+Postgres cannot build an index on a partitioned table CONCURRENTLY.
+When corpus is partitioned (see `partitions.py`) the index is built on
+every partition in one statement, which blocks writes, not reads,
+until it finishes; partitions added later get it automatically.
+"""
+
+import argparse
+from typing import Iterable, Optional
+
+from psycopg2 import sql
+
+from corpus_loader import EMBEDDING_COLUMNS, EMBEDDING_DIMENSIONS
+from database import connect
+from partitions import is_partitioned
+from search import QUANTIZATIONS
+
+INDEX_METHODS = ("hnsw", "ivfflat")
+
+# pgvector's own defaults.
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 64
+DEFAULT_LISTS = 100
+
+DISTANCE_OPS = "vector_cosine_ops"
+
+# Operator classes for each quantized expression.
+QUANTIZED_OPS = {
+    "halfvec": "halfvec_cosine_ops",
+    "binary": "bit_hamming_ops",
+}
+
+
+def create_index_config(
+    column: str,
+    method: str = "hnsw",
+    m: int = DEFAULT_M,
+    ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+    lists: int = DEFAULT_LISTS,
+    quantization: Optional[str] = None,
+):
+    if column not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {column}")
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Unknown index method: {method}")
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+
+    return {
+        "column": column,
+        "method": method,
+        "m": m,
+        "ef_construction": ef_construction,
+        "lists": lists,
+        "quantization": quantization,
+    }
+
+
+def index_name(config) -> str:
+    parts = [config["column"], config["method"]]
+    if config["quantization"] is not None:
+        parts.append(config["quantization"])
+    return f"corpus_{'_'.join(parts)}_idx"
+
+
+def indexed_expression(config) -> sql.Composable:
+    """
+    What the index covers and with which operator class. Quantized
+    expressions must match `search.quantized_distance` exactly for the
+    planner to use the index.
+    """
+    column = sql.Identifier(config["column"])
+    dim = sql.Literal(EMBEDDING_DIMENSIONS[config["column"]])
+    quantization = config["quantization"]
+
+    if quantization is None:
+        expression = sql.SQL("{}").format(column)
+        ops = DISTANCE_OPS
+    elif quantization == "halfvec":
+        expression = sql.SQL("({}::halfvec({}))").format(column, dim)
+        ops = QUANTIZED_OPS[quantization]
+    else:
+        expression = sql.SQL("(binary_quantize({})::bit({}))").format(
+            column, dim
+        )
+        ops = QUANTIZED_OPS[quantization]
+
+    return sql.SQL("{} {}").format(expression, sql.SQL(ops))
+
+
+def index_options(config) -> sql.Composable:
+    if config["method"] == "hnsw":
+        return sql.SQL("m = {}, ef_construction = {}").format(
+            sql.Literal(config["m"]),
+            sql.Literal(config["ef_construction"]),
+        )
+
+    return sql.SQL("lists = {}").format(sql.Literal(config["lists"]))
+
+
+def concurrently(enabled: bool) -> sql.Composable:
+    return sql.SQL("CONCURRENTLY " if enabled else "")
+
+
+def create_index_statement(
+    config, concurrent: bool = True
+) -> sql.Composable:
+    return sql.SQL(
+        "CREATE INDEX {concurrently}IF NOT EXISTS {name} ON corpus "
+        "USING {method} ({expression}) WITH ({options})"
+    ).format(
+        concurrently=concurrently(concurrent),
+        name=sql.Identifier(index_name(config)),
+        method=sql.SQL(config["method"]),
+        expression=indexed_expression(config),
+        options=index_options(config),
+    )
+
+
+def drop_index_statement(
+    config, concurrent: bool = True
+) -> sql.Composable:
+    return sql.SQL("DROP INDEX {}IF EXISTS {}").format(
+        concurrently(concurrent), sql.Identifier(index_name(config))
+    )
+
+
+TEXT_SEARCH_INDEX = "corpus_chunk_tsv_idx"
+
+ADD_TEXT_SEARCH_COLUMN = (
+    "ALTER TABLE corpus ADD COLUMN IF NOT EXISTS chunk_tsv TSVECTOR "
+    "GENERATED ALWAYS AS (to_tsvector('english', chunk_text)) STORED"
+)
+
+
+def add_text_search(connection):
+    """
+    Add the generated `chunk_tsv` column and its GIN index to a corpus
+    table created before docs/schema.sql had them. Adding the column
+    rewrites the table once.
+    """
+    connection.autocommit = True
+
+    with connection.cursor() as cursor:
+        concurrent = not is_partitioned(cursor)
+        cursor.execute(ADD_TEXT_SEARCH_COLUMN)
+        cursor.execute(
+            sql.SQL(
+                "CREATE INDEX {}IF NOT EXISTS {} "
+                "ON corpus USING GIN (chunk_tsv)"
+            ).format(
+                concurrently(concurrent),
+                sql.Identifier(TEXT_SEARCH_INDEX),
+            )
+        )
+
+    print(f"Created chunk_tsv and {TEXT_SEARCH_INDEX}")
+
+
+def migrate(
+    connection,
+    configs: Iterable,
+    drop: bool = False,
+    maintenance_work_mem: Optional[str] = None,
+):
+    """
+    Create (or with `drop`, remove) the index for each config.
+    """
+    # CONCURRENTLY cannot run inside a transaction block.
+    connection.autocommit = True
+
+    with connection.cursor() as cursor:
+        concurrent = not is_partitioned(cursor)
+
+        if maintenance_work_mem:
+            # HNSW builds are much faster when the graph fits in memory.
+            cursor.execute(
+                "SET maintenance_work_mem = %s", (maintenance_work_mem,)
+            )
+
+        for config in configs:
+            if drop:
+                cursor.execute(drop_index_statement(config, concurrent))
+                print(f"Dropped {index_name(config)}")
+            else:
+                cursor.execute(
+                    create_index_statement(config, concurrent)
+                )
+                print(f"Created {index_name(config)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create ANN indexes on the corpus embeddings.",
+    )
+    parser.add_argument(
+        "--columns",
+        nargs="+",
+        choices=EMBEDDING_COLUMNS,
+        default=EMBEDDING_COLUMNS,
+    )
+    parser.add_argument(
+        "--method", choices=INDEX_METHODS, default="hnsw"
+    )
+    parser.add_argument("--m", type=int, default=DEFAULT_M)
+    parser.add_argument(
+        "--ef-construction", type=int, default=DEFAULT_EF_CONSTRUCTION
+    )
+    parser.add_argument("--lists", type=int, default=DEFAULT_LISTS)
+    parser.add_argument(
+        "--maintenance-work-mem",
+        help="e.g. 1GB, for the duration of the build",
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="drop the indexes instead of creating them",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATIONS,
+        help="index a quantized copy of each column",
+    )
+    parser.add_argument(
+        "--text-search",
+        action="store_true",
+        help="add the full-text search column and index instead",
+    )
+    args = parser.parse_args()
+
+    configs = [
+        create_index_config(
+            column,
+            args.method,
+            m=args.m,
+            ef_construction=args.ef_construction,
+            lists=args.lists,
+            quantization=args.quantization,
+        )
+        for column in args.columns
+    ]
+
+    connection = connect()
+    try:
+        if args.text_search:
+            add_text_search(connection)
+        else:
+            migrate(
+                connection,
+                configs,
+                drop=args.drop,
+                maintenance_work_mem=args.maintenance_work_mem,
+            )
+    finally:
+        connection.close()
@@ -0,0 +1,200 @@
+"""
+Partitioning of the corpus by book.
+
+`corpus` is list-partitioned on book_title, one partition per book,
+named `corpus_<slug>` after the title (see `partition_name`), with a
+numeric suffix when another table already has that name. The name is
+only a label: which partition holds a book is always read from the
+catalog (see `list_partitions`). Indexes
+created on `corpus` are created on every partition, including ones
+added later, so each book has its own HNSW graph. A search filtered to
+some books then walks only their graphs (see `search.py`) instead of
+walking the whole corpus's graph and discarding other books' rows,
+which at low k can leave too few rows or none.
+
+`load_corpus` creates a book's partition the first time it is loaded.
+To convert a corpus table created before partitioning:
+
+    python partitions.py
+"""
+
+import re
+from typing import Dict
+
+from psycopg2 import sql
+
+from database import connect
+
+# Postgres truncates identifiers beyond this many bytes.
+MAX_IDENTIFIER_LENGTH = 63
+
+# Each partition of corpus and its bound, "FOR VALUES IN ('...')".
+PARTITION_BOUNDS = """
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass('corpus')
+"""
+
+# A quoted value in a partition bound; quotes inside it are doubled.
+BOUND_VALUE = re.compile(r"'((?:[^']|'')*)'")
+
+CREATE_PARTITIONED_CORPUS = """
+CREATE TABLE corpus (
+    id SERIAL,
+    book_title VARCHAR(255) NOT NULL,
+    chapter_title VARCHAR(255),
+    chunk_sequence INT NOT NULL,
+    chunk_text TEXT NOT NULL,
+    chunk_tsv TSVECTOR GENERATED ALWAYS AS
+        (to_tsvector('english', chunk_text)) STORED,
+    nomic_embeddings VECTOR(768),
+    mxb_embeddings VECTOR(1024),
+    bge_embeddings VECTOR(1024),
+    PRIMARY KEY (id, book_title)
+) PARTITION BY LIST (book_title)
+"""
+
+COPIED_COLUMNS = (
+    "id",
+    "book_title",
+    "chapter_title",
+    "chunk_sequence",
+    "chunk_text",
+    "nomic_embeddings",
+    "mxb_embeddings",
+    "bge_embeddings",
+)
+
+
+def partition_name(book_title: str, suffix: str = "") -> str:
+    slug = re.sub(r"[^a-z0-9]+", "_", book_title.lower()).strip("_")
+    # Truncated by characters, which are bytes once slugged.
+    base = f"corpus_{slug}"[: MAX_IDENTIFIER_LENGTH - len(suffix)]
+    return base + suffix
+
+
+def is_partitioned(cursor) -> bool:
+    cursor.execute(
+        "SELECT relkind = 'p' FROM pg_class "
+        "WHERE oid = to_regclass('corpus')"
+    )
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def list_partitions(cursor) -> Dict[str, str]:
+    """
+    The partition holding each book title, from the catalog.
+    """
+    cursor.execute(PARTITION_BOUNDS)
+
+    partitions = {}
+    for name, bound in cursor.fetchall():
+        for value in BOUND_VALUE.findall(bound or ""):
+            partitions[value.replace("''", "'")] = name
+
+    return partitions
+
+
+def forget_partitions(connection):
+    """
+    Drop the routing cache of a pooled connection (see
+    `database.PreparingConnection`) after changing the partitions.
+    """
+    if hasattr(connection, "partitions"):
+        connection.partitions = None
+
+
+def table_exists(cursor, name: str) -> bool:
+    cursor.execute(
+        "SELECT to_regclass(%s) IS NOT NULL",
+        (sql.Identifier(name).as_string(cursor),),
+    )
+    return cursor.fetchone()[0]
+
+
+def ensure_partition(cursor, book_title: str) -> str:
+    """
+    The partition for `book_title`, created if there is none yet.
+    Titles whose names collide get distinct partitions.
+    """
+    partition = list_partitions(cursor).get(book_title)
+    if partition is not None:
+        return partition
+
+    partition = partition_name(book_title)
+    number = 2
+    while table_exists(cursor, partition):
+        partition = partition_name(book_title, f"_{number}")
+        number += 1
+
+    cursor.execute(
+        sql.SQL(
+            "CREATE TABLE {} PARTITION OF corpus FOR VALUES IN ({})"
+        ).format(
+            sql.Identifier(partition),
+            sql.Literal(book_title),
+        )
+    )
+    forget_partitions(cursor.connection)
+    return partition
+
+
+def partition_corpus(connection):
+    """
+    Rebuild an unpartitioned corpus as a partitioned one, keeping ids,
+    in one transaction. Indexes are not carried over; recreate them
+    with `indexes.py` afterwards.
+    """
+    columns = sql.SQL(", ").join(map(sql.Identifier, COPIED_COLUMNS))
+
+    with connection:
+        with connection.cursor() as cursor:
+            if is_partitioned(cursor):
+                print("corpus is already partitioned")
+                return
+
+            # The old table's key and sequence would otherwise claim
+            # the names the new table's get.
+            cursor.execute(
+                "ALTER TABLE corpus RENAME TO corpus_unpartitioned"
+            )
+            cursor.execute(
+                "ALTER TABLE corpus_unpartitioned "
+                "RENAME CONSTRAINT corpus_pkey TO corpus_unpartitioned_pkey"
+            )
+            cursor.execute(
+                "ALTER SEQUENCE corpus_id_seq "
+                "RENAME TO corpus_unpartitioned_id_seq"
+            )
+            cursor.execute(CREATE_PARTITIONED_CORPUS)
+
+            cursor.execute(
+                "SELECT DISTINCT book_title FROM corpus_unpartitioned"
+            )
+            book_titles = [row[0] for row in cursor.fetchall()]
+            for book_title in book_titles:
+                ensure_partition(cursor, book_title)
+
+            cursor.execute(
+                sql.SQL(
+                    "INSERT INTO corpus ({columns}) "
+                    "SELECT {columns} FROM corpus_unpartitioned"
+                ).format(columns=columns)
+            )
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('corpus', 'id'), "
+                "coalesce(max(id), 0) + 1, false) FROM corpus"
+            )
+            cursor.execute("DROP TABLE corpus_unpartitioned")
+            forget_partitions(connection)
+
+    print(f"Partitioned corpus into {len(book_titles)} books")
+
+
+if __name__ == "__main__":
+    connection = connect()
+    try:
+        partition_corpus(connection)
+    finally:
+        connection.close()
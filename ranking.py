@@ -0,0 +1,131 @@
+"""
+Rank fusion and re-ranking of search results.
+"""
+
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+# The usual RRF damping constant: large enough that the first few
+# places of one list do not swamp agreement between lists.
+DEFAULT_RRF_K = 60
+
+# MMR's balance between relevance to the query (1.0) and difference
+# from the results already chosen (0.0).
+DEFAULT_MMR_LAMBDA = 0.5
+
+
+def create_fused_result(key: Hashable, score: float, ranks: Dict):
+    return {
+        "key": key,
+        "score": score,
+        "ranks": ranks,
+    }
+
+
+def weighted_rrf(
+    rankings: Dict[str, Sequence[Hashable]],
+    weights: Optional[Dict[str, float]] = None,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> List:
+    """
+    Fuse named rankings (keys, best first) by weighted reciprocal rank
+    fusion: each key scores weight / (rrf_k + rank) in every ranking
+    it appears in, ranks counting from 1. Returns dicts from
+    `create_fused_result`, best first, with each key's rank per
+    ranking it appeared in.
+    """
+    weights = weights or {}
+    scores = {}
+    ranks = {}
+
+    for name, keys in rankings.items():
+        weight = weights.get(name, 1.0)
+
+        for rank, key in enumerate(keys, start=1):
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            ranks.setdefault(key, {})[name] = rank
+
+    fused = [
+        create_fused_result(key, score, ranks[key])
+        for key, score in scores.items()
+    ]
+    # Ties keep first-seen order, which favours the first ranking.
+    fused.sort(key=lambda result: result["score"], reverse=True)
+    return fused
+
+
+def contributions(
+    fused: Sequence,
+    weights: Optional[Dict[str, float]] = None,
+    rrf_k: int = DEFAULT_RRF_K,
+) -> Dict[str, Dict]:
+    """
+    How much each ranking contributed to `fused` results: the number
+    of results it ranked at all, and its share of their total score.
+    """
+    weights = weights or {}
+    total = sum(result["score"] for result in fused) or 1.0
+    report = {}
+
+    for result in fused:
+        for name, rank in result["ranks"].items():
+            entry = report.setdefault(name, {"hits": 0, "share": 0.0})
+            entry["hits"] += 1
+            entry["share"] += (
+                weights.get(name, 1.0) / (rrf_k + rank) / total
+            )
+
+    return report
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def mmr(
+    query: Sequence[float],
+    candidates: np.ndarray,
+    k: int,
+    lambda_: float = DEFAULT_MMR_LAMBDA,
+) -> List[int]:
+    """
+    Indices of `k` rows of `candidates` picked by maximal marginal
+    relevance: each pick maximises
+
+        lambda_ * sim(query, c) - (1 - lambda_) * max sim(c, picked)
+
+    under cosine similarity. The candidate-candidate similarities are
+    computed once, and the max over the picked rows is kept as a
+    vector updated with each pick, so selection is O(k * n) on top of
+    the one matrix product.
+    """
+    vectors = normalize_rows(np.asarray(candidates, dtype=np.float64))
+    relevance = vectors @ normalize_rows(
+        np.asarray(query, dtype=np.float64)
+    )
+    similarity = vectors @ vectors.T
+
+    count = len(vectors)
+    redundancy = np.zeros(count)
+    available = np.ones(count, dtype=bool)
+    picked = []
+
+    for _ in range(min(k, count)):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+
+        best = int(np.argmax(scores))
+        available[best] = False
+
+        # Nothing is redundant before the first pick; after it, the
+        # max starts from that pick's similarities, which may be
+        # negative.
+        if picked:
+            np.maximum(redundancy, similarity[best], out=redundancy)
+        else:
+            redundancy = similarity[best].copy()
+        picked.append(best)
+
+    return picked
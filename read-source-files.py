@@ -1,6 +1,14 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from itertools import repeat
+import json
 import os
 import re
 
+from books import write_manifest
+from chapter_detector import detect_chapters
+
 books = (
     "a_crystal_age",
     "a_modern_utopia",
@@ -14,19 +22,376 @@ books = (
     "utopia",
 )
 
+# Hashes of every source file and extracted chapter as of the last run.
+MANIFEST_PATH = "source/manifest.json"
+
+# What was added, changed or removed since the file was last consumed,
+# for chunking, embedding and loading to pick up only the affected
+# chapters. Each run merges its changes into the pending ones; delete
+# the file once they have been applied.
+CHANGES_PATH = "source/changes.json"
+
+BOOK_STATUSES = ("added", "changed", "removed", "unchanged", "error")
+
 
 start = r"\*\*\* START OF THE PROJECT GUTENBERG EBOOK .*? \*\*\*"
 end = r"\*\*\* END OF THE PROJECT GUTENBERG EBOOK .*? \*\*\*"
 
-combined_regex = rf"{start}(.*?)({end})"
+# The markers each sit on a line of their own, so sources are scanned
+# a line at a time rather than searched whole.
+start_marker = re.compile(start)
+end_marker = re.compile(end)
+
+HASH_BLOCK_SIZE = 1 << 20
+
+# Front matter paragraphs that credit the transcribers, not the book.
+CREDIT_PREFIXES = ("Produced by", "E-text prepared", "Transcrib")
+
+
+def source_path(book):
+    return f"source/{book.replace('_', '-')}.txt"
+
+
+def output_path(book):
+    return f"books/{book}.py"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def load_manifest():
+    return load_json(MANIFEST_PATH, {})
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_atomically(path, text):
+    # Readers, and books processed in parallel, never see a partly
+    # written file.
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+def write_json(path, data):
+    write_atomically(path, json.dumps(data, indent=2) + "\n")
+
+
+def read_body(path):
+    """
+    The text between a source's START and END markers, or None when
+    either is missing.
+    """
+    lines = []
+    inside = False
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not inside:
+                inside = start_marker.search(line) is not None
+            elif end_marker.search(line):
+                return "".join(lines).strip()
+            else:
+                lines.append(line)
+
+    return None
+
+
+def extract_chapters(book):
+    return {
+        chapter["id"]: chapter["text"] for chapter in book["chapters"]
+    }
+
+
+def find_title(book_id, front_matter):
+    for paragraph in front_matter.split("\n\n"):
+        paragraph = paragraph.strip()
+        if paragraph and not paragraph.startswith(CREDIT_PREFIXES):
+            return paragraph
+
+    return book_id.replace("_", " ").title()
+
+
+def quote(text):
+    if '"""' in text or "\\" in text or text.endswith('"'):
+        return repr(text)
+
+    return f'"""\n{text}\n"""'
+
+
+def render_book(book_id, book):
+    """
+    Python source for a book module: its title, a contents list of the
+    chapter titles, the front matter and then one string per chapter.
+    """
+    contents = "".join(
+        f"    {json.dumps(chapter['title'] or chapter['id'], ensure_ascii=False)},\n"
+        for chapter in book["chapters"]
+    )
+    parts = [
+        f"title = {quote(find_title(book_id, book['front_matter']))}",
+        f"contents = [\n{contents}]",
+        f"front_matter = {quote(book['front_matter'])}",
+    ]
+    parts.extend(
+        f"{chapter['id']} = {quote(chapter['text'])}"
+        for chapter in book["chapters"]
+    )
+
+    return "\n\n".join(parts) + "\n"
+
+
+def diff_chapters(book, previous, current):
+    changes = []
+
+    for chapter, digest in current.items():
+        if chapter not in previous:
+            changes.append(
+                {"book": book, "chapter": chapter, "status": "added"}
+            )
+        elif previous[chapter] != digest:
+            changes.append(
+                {"book": book, "chapter": chapter, "status": "changed"}
+            )
+
+    for chapter in previous:
+        if chapter not in current:
+            changes.append(
+                {"book": book, "chapter": chapter, "status": "removed"}
+            )
+
+    return changes
+
+
+def empty_changes():
+    return {
+        "books": {status: [] for status in BOOK_STATUSES},
+        "chapters": [],
+    }
+
+
+def merge_status(pending, current):
+    """
+    The net status of a book or chapter with a `pending` change that
+    changed again as `current`, or None if the two cancel out.
+    """
+    if pending == "added":
+        return None if current == "removed" else "added"
+    if pending == "removed" and current == "added":
+        return "changed"
+    return current
+
+
+def merge_changes(pending, current, books_present, errors):
+    """
+    `current`'s changes on top of the `pending` ones not yet consumed.
+    """
+    chapters = {}
+    for change in pending["chapters"] + current["chapters"]:
+        key = change["book"], change["chapter"]
+        status = merge_status(
+            chapters[key]["status"] if key in chapters else None,
+            change["status"],
+        )
+        if status is None:
+            del chapters[key]
+        else:
+            chapters[key] = dict(change, status=status)
+
+    book_statuses = {}
+    for changes in (pending, current):
+        for status in ("added", "changed", "removed"):
+            for book in changes["books"][status]:
+                merged = merge_status(book_statuses.get(book), status)
+                if merged is None:
+                    del book_statuses[book]
+                else:
+                    book_statuses[book] = merged
+
+    merged = empty_changes()
+    merged["chapters"] = list(chapters.values())
+    for book, status in book_statuses.items():
+        merged["books"][status].append(book)
+    merged["books"]["unchanged"] = [
+        book
+        for book in books_present
+        if book not in book_statuses and book not in errors
+    ]
+    merged["books"]["error"] = list(errors)
+
+    return merged
+
+
+def extract_book(book, previous_source, force):
+    """
+    Rewrite one book's module if its source changed. Runs in a worker
+    process; returns the new source hash and, if the module was
+    rewritten, the hash of each chapter.
+    """
+    source_hash = file_hash(source_path(book))
+
+    if (
+        not force
+        and previous_source == source_hash
+        and os.path.exists(output_path(book))
+    ):
+        return {
+            "book": book,
+            "source": source_hash,
+            "status": "unchanged",
+        }
+
+    body = read_body(source_path(book))
+    if body is None:
+        return {
+            "book": book,
+            "source": source_hash,
+            "status": "missing",
+        }
+
+    detected = detect_chapters(body)
+    write_atomically(output_path(book), render_book(book, detected))
+
+    return {
+        "book": book,
+        "source": source_hash,
+        "status": "extracted",
+        "chapters": {
+            chapter: content_hash(text.encode("utf-8"))
+            for chapter, text in extract_chapters(detected).items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract the Gutenberg sources in source/ into books/.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild every book, even if its source is unchanged",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of books to extract in parallel",
+    )
+    args = parser.parse_args()
+
+    manifest = load_manifest()
+    updated_manifest = {}
+    rewritten = []
+    changes = empty_changes()
+
+    previous_sources = [
+        manifest[book]["source"] if book in manifest else None
+        for book in books
+    ]
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(
+            executor.map(
+                extract_book,
+                books,
+                previous_sources,
+                repeat(args.force),
+            )
+        )
+
+    for result in results:
+        book = result["book"]
+        previous = manifest.get(book)
+
+        if result["status"] == "unchanged":
+            updated_manifest[book] = previous
+            changes["books"]["unchanged"].append(book)
+            continue
+
+        if result["status"] == "missing":
+            # The markers moved, not the book: keep what was extracted
+            # last time and leave its module alone.
+            if previous is not None:
+                updated_manifest[book] = previous
+            changes["books"]["error"].append(book)
+            continue
+
+        rewritten.append(book)
+        chapters = result["chapters"]
+        updated_manifest[book] = {
+            "source": result["source"],
+            "chapters": chapters,
+        }
+
+        previous_chapters = previous["chapters"] if previous else {}
+        chapter_changes = diff_chapters(
+            book,
+            previous_chapters,
+            chapters,
+        )
+        changes["chapters"].extend(chapter_changes)
+
+        if previous is None:
+            changes["books"]["added"].append(book)
+        elif chapter_changes:
+            changes["books"]["changed"].append(book)
+        else:
+            changes["books"]["unchanged"].append(book)
+
+    for book, entry in manifest.items():
+        if book not in updated_manifest:
+            changes["books"]["removed"].append(book)
+            changes["chapters"].extend(
+                diff_chapters(book, entry["chapters"], {})
+            )
+
+    pending = load_json(CHANGES_PATH, empty_changes())
+
+    write_json(MANIFEST_PATH, updated_manifest)
+    write_json(
+        CHANGES_PATH,
+        merge_changes(
+            pending,
+            changes,
+            updated_manifest,
+            changes["books"]["error"],
+        ),
+    )
+
+    # The registry lists chapters from the module sources, so it has to
+    # be rebuilt whenever a module is rewritten.
+    if rewritten or changes["books"]["removed"]:
+        write_manifest()
+
+    for status, names in changes["books"].items():
+        if names and status != "error":
+            print(f"{status}: {', '.join(names)}")
+
+    for book in changes["books"]["error"]:
+        print(
+            f"error: no START/END markers in {source_path(book)}; "
+            f"kept the previous extraction of {book}"
+        )
 
-for book in books:
-    with open(f"source/{book}.txt", "r") as f:
-        raw_content = f.read()
 
-        if content := re.search(combined_regex, raw_content, re.DOTALL):
-            extracted_content = content.group(1).strip()
-            with open(f"books/{book}.py", "w") as out_f:
-                out_f.write('"""\n')
-                out_f.write(extracted_content)
-                out_f.write('\n"""')
+# Worker processes import this file too, so the run itself only
+# happens in the parent.
+if __name__ == "__main__":
+    main()
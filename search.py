@@ -0,0 +1,592 @@
+"""
+Nearest-neighbour search over the corpus.
+
+`search` ranks chunks by cosine distance between one embedding column
+and a query embedding from the same model. With the indexes from
+`indexes.py` in place, the recall/latency trade-off is set per query:
+`ef_search` for HNSW (pgvector's default is 40) and `probes` for
+IVFFlat (default 1). An HNSW scan returns at most `ef_search` rows, so
+it is raised to the number of rows the query asks the index for when
+lower. Both are applied with SET LOCAL, so they last only for the
+query's transaction and do not leak to the next user of the pooled
+connection.
+
+Each combination of column and filter is a prepared statement, made
+once per pooled connection and then only executed, so repeat queries
+skip parsing and planning.
+
+Filtering to some books is routed to those books' partitions (see
+`partitions.py`), looked up in the catalog: each is searched on its
+own index and the results merged, rather than filtering the nearest
+rows of the whole corpus. Titles without a partition match nothing.
+
+`hybrid_search` adds full-text search over `chunk_tsv` (see
+`indexes.py --text-search`): the top candidates by vector distance
+and by `ts_rank` are fused with reciprocal rank fusion, each chunk
+scoring 1 / (rrf_k + rank) per list it appears in, all in one query.
+Exact names and rare words that embeddings blur ("Dr. Leete") are
+then found by the lexical side.
+
+`fusion_search` queries several embedding columns at once, one pooled
+connection per column, and fuses their rankings with weighted RRF.
+
+`mmr_search` diversifies: it fetches a pool of candidates through the
+index, with their embeddings, and picks from them by maximal marginal
+relevance in NumPy.
+
+`search` and `mmr_search` can also search a quantized copy of the
+embeddings, through the expression indexes `indexes.py
+--quantization` builds: "halfvec" (half-precision floats, half the
+index size) or "binary" (one bit per dimension compared by Hamming
+distance, a 32nd). The nearest candidates by the quantized distance
+are then reranked by exact cosine distance on the full-precision
+column, in the same query. Binary distances are coarse, so a deeper
+pool of candidates is reranked for them by default. This saves index
+size and memory only; the table and its full-precision vectors are
+unchanged.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import time
+from typing import Dict, List, Optional, Sequence
+
+from psycopg2 import sql
+
+from corpus_loader import EMBEDDING_COLUMNS, EMBEDDING_DIMENSIONS
+from database import Vector, cursor, prepare
+import numpy as np
+from partitions import is_partitioned, list_partitions
+from ranking import (
+    DEFAULT_MMR_LAMBDA,
+    DEFAULT_RRF_K,
+    contributions,
+    mmr,
+    weighted_rrf,
+)
+
+DEFAULT_K = 10
+
+# pgvector's hnsw.ef_search when it is not set.
+DEFAULT_EF_SEARCH = 40
+
+# How many chunks each ranking contributes to a hybrid or fusion
+# search, and the pool MMR picks from.
+DEFAULT_CANDIDATES = 50
+
+QUANTIZATIONS = ("halfvec", "binary")
+
+# How many candidates a quantized index hands to the rerank by default.
+# Hamming distance over one bit per dimension ties and misorders far
+# more often than a halfvec cosine, so binary needs a deeper pool.
+QUANTIZED_CANDIDATES = {
+    "halfvec": DEFAULT_CANDIDATES,
+    "binary": 4 * DEFAULT_CANDIDATES,
+}
+
+RESULT_COLUMNS = (
+    "id",
+    "book_title",
+    "chapter_title",
+    "chunk_sequence",
+    "chunk_text",
+)
+
+
+def create_search_result(row):
+    return {
+        "id": row[0],
+        "book_title": row[1],
+        "chapter_title": row[2],
+        "chunk_sequence": row[3],
+        "chunk_text": row[4],
+        "distance": row[5],
+    }
+
+
+def statement_name(kind: str, column: str, shape: str) -> str:
+    return f"{kind}_{column}_{shape}"
+
+
+def quantized_kind(kind: str, quantization: Optional[str]) -> str:
+    return kind if quantization is None else f"{kind}_{quantization}"
+
+
+def partitions_shape(partitions: Optional[Sequence[str]]) -> str:
+    if partitions is None:
+        return "all"
+
+    # Names are limited to 63 bytes, so the set of partitions is
+    # hashed rather than spelled out.
+    digest = hashlib.sha1(",".join(partitions).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def book_partitions(cur, book_titles: Sequence[str]) -> List[str]:
+    """
+    The tables holding `book_titles`: their partitions, or the whole
+    corpus if it is not partitioned.
+
+    The catalog is read once per pooled connection and cached on it,
+    so a filtered search costs no more round trips than an unfiltered
+    one. A title missing from the cache re-reads it, which picks up
+    books loaded since through other connections.
+    """
+    conn = cur.connection
+    routes = getattr(conn, "partitions", None)
+
+    if routes is None or (
+        routes[0] and not set(book_titles) <= routes[1].keys()
+    ):
+        routes = (is_partitioned(cur), list_partitions(cur))
+        if hasattr(conn, "partitions"):
+            conn.partitions = routes
+
+    partitioned, partitions = routes
+    if not partitioned:
+        return ["corpus"]
+
+    return sorted(
+        {
+            partitions[title]
+            for title in book_titles
+            if title in partitions
+        }
+    )
+
+
+def quantized_pool(
+    quantization: str, candidates: Optional[int], least: int
+) -> int:
+    """
+    How many rows to take from the quantized index: `candidates`, or
+    the default for `quantization`, and never fewer than `least`.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+
+    if candidates is None:
+        candidates = QUANTIZED_CANDIDATES[quantization]
+    return max(candidates, least)
+
+
+def quantized_distance(
+    column: str, quantization: str
+) -> sql.Composable:
+    """
+    The distance an index from `indexes.py --quantization` orders by,
+    between `column` and the query vector $1.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+
+    if quantization == "halfvec":
+        template = (
+            "{column}::halfvec({dim}) <=> $1::vector::halfvec({dim})"
+        )
+    else:
+        template = (
+            "binary_quantize({column})::bit({dim}) "
+            "<~> binary_quantize($1::vector)"
+        )
+
+    return sql.SQL(template).format(
+        column=sql.Identifier(column),
+        dim=sql.Literal(EMBEDDING_DIMENSIONS[column]),
+    )
+
+
+def search_statement(
+    column: str,
+    partitions: Optional[Sequence[str]] = None,
+    with_embeddings: bool = False,
+    quantization: Optional[str] = None,
+) -> sql.Composable:
+    """
+    The search query, parameterised as $1 the query vector and $2 the
+    limit. With `quantization`, $3 is the number of candidates taken
+    by the quantized distance before reranking by the exact one.
+
+    With `partitions`, the next parameter is an array of book titles,
+    and each of those tables is searched on its own index for its
+    nearest $2 of those books, and the results merged, so a filter
+    never leaves fewer than $2 rows while the books have them. With
+    `with_embeddings`, each row ends with its embedding as real[],
+    which psycopg2 reads as a list of floats.
+    """
+    if column not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {column}")
+
+    columns = sql.SQL(", ").join(map(sql.Identifier, RESULT_COLUMNS))
+    embedding = sql.SQL(
+        ", {}::real[]" if with_embeddings else ""
+    ).format(sql.Identifier(column))
+
+    # Partitions can hold more than one book, and an unpartitioned
+    # corpus holds them all.
+    books_param = 3 if quantization is None else 4
+    books = sql.SQL(
+        f"WHERE book_title = ANY(${books_param}) "
+        if partitions is not None
+        else ""
+    )
+
+    def nearest(table):
+        if quantization is None:
+            return sql.SQL(
+                "SELECT {columns}, {column} <=> $1 AS distance{embedding} "
+                "FROM {table} {books}ORDER BY {column} <=> $1 LIMIT $2"
+            ).format(
+                columns=columns,
+                column=sql.Identifier(column),
+                embedding=embedding,
+                table=sql.Identifier(table),
+                books=books,
+            )
+
+        # The inner query walks the quantized index; the outer one
+        # reranks its candidates on the full-precision vectors.
+        return sql.SQL(
+            "SELECT {columns}, {column}::vector <=> $1::vector AS distance"
+            "{embedding} FROM (SELECT {columns}, {column} FROM {table} "
+            "{books}ORDER BY {quantized} LIMIT $3) candidates "
+            "ORDER BY distance LIMIT $2"
+        ).format(
+            columns=columns,
+            column=sql.Identifier(column),
+            embedding=embedding,
+            table=sql.Identifier(table),
+            books=books,
+            quantized=quantized_distance(column, quantization),
+        )
+
+    if partitions is None:
+        return nearest("corpus")
+
+    routed = sql.SQL(" UNION ALL ").join(
+        sql.SQL("({})").format(nearest(partition))
+        for partition in partitions
+    )
+    return sql.SQL(
+        "SELECT * FROM ({}) routed ORDER BY distance LIMIT $2"
+    ).format(routed)
+
+
+def create_hybrid_result(row):
+    return {
+        "id": row[0],
+        "book_title": row[1],
+        "chapter_title": row[2],
+        "chunk_sequence": row[3],
+        "chunk_text": row[4],
+        "score": row[5],
+        "vector_rank": row[6],
+        "text_rank": row[7],
+    }
+
+
+def hybrid_statement(column: str, filtered: bool) -> sql.Composable:
+    """
+    The hybrid query, parameterised as $1 the query vector, $2 the
+    query text, $3 the candidates per side, $4 the RRF constant, $5
+    the limit and, if `filtered`, $6 an array of book titles.
+    """
+    if column not in EMBEDDING_COLUMNS:
+        raise ValueError(f"Unknown embedding column: {column}")
+
+    books = "book_title = ANY($6)"
+
+    return sql.SQL(
+        "WITH vector_ranked AS ("
+        " SELECT id, row_number() OVER (ORDER BY distance) AS rank"
+        " FROM (SELECT id, {column} <=> $1 AS distance FROM corpus"
+        " {vector_where}ORDER BY {column} <=> $1 LIMIT $3) nearest"
+        "), text_ranked AS ("
+        " SELECT id, row_number() OVER (ORDER BY text_score DESC) AS rank"
+        " FROM (SELECT id, ts_rank(chunk_tsv, query) AS text_score"
+        " FROM corpus, websearch_to_tsquery('english', $2) query"
+        " WHERE chunk_tsv @@ query{text_where}"
+        " ORDER BY text_score DESC LIMIT $3) matches"
+        ") "
+        "SELECT {columns},"
+        " coalesce(1.0 / ($4 + v.rank), 0)::float8"
+        " + coalesce(1.0 / ($4 + t.rank), 0)::float8 AS score,"
+        " v.rank, t.rank "
+        "FROM vector_ranked v FULL JOIN text_ranked t USING (id) "
+        "JOIN corpus c USING (id) "
+        "ORDER BY score DESC LIMIT $5"
+    ).format(
+        column=sql.Identifier(column),
+        vector_where=sql.SQL(f"WHERE {books} " if filtered else ""),
+        text_where=sql.SQL(f" AND {books}" if filtered else ""),
+        columns=sql.SQL(", ").join(
+            sql.Identifier("c", name) for name in RESULT_COLUMNS
+        ),
+    )
+
+
+def execute_prepared(cur, name: str, statement, params: List):
+    prepare(cur, name, statement)
+    cur.execute(
+        sql.SQL("EXECUTE {} ({})").format(
+            sql.Identifier(name),
+            sql.SQL(", ").join(sql.Placeholder() * len(params)),
+        ),
+        params,
+    )
+
+
+def apply_search_settings(
+    cur,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    limit: Optional[int] = None,
+):
+    """
+    `limit` is the most rows the query takes from an index scan;
+    ef_search is raised to it so that HNSW can return them all.
+    """
+    if ef_search is not None or (
+        limit is not None and limit > DEFAULT_EF_SEARCH
+    ):
+        ef_search = max(ef_search or DEFAULT_EF_SEARCH, limit or 0)
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (int(ef_search),))
+    if probes is not None:
+        cur.execute("SET LOCAL ivfflat.probes = %s", (int(probes),))
+
+
+def execute_search(
+    cur,
+    kind: str,
+    column: str,
+    params: List,
+    book_titles: Optional[Sequence[str]],
+    quantization: Optional[str],
+    with_embeddings: bool = False,
+) -> bool:
+    """
+    Run the search statement for `params`, routed to `book_titles`.
+    Returns False, having run nothing, if none of the books has rows.
+    """
+    partitions = None
+    if book_titles is not None:
+        partitions = book_partitions(cur, book_titles)
+        if not partitions:
+            return False
+        params = params + [list(book_titles)]
+
+    execute_prepared(
+        cur,
+        statement_name(
+            quantized_kind(kind, quantization),
+            column,
+            partitions_shape(partitions),
+        ),
+        search_statement(
+            column,
+            partitions,
+            with_embeddings=with_embeddings,
+            quantization=quantization,
+        ),
+        params,
+    )
+    return True
+
+
+def search(
+    query_embedding: Sequence[float],
+    column: str = "nomic_embeddings",
+    k: int = DEFAULT_K,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    book_titles: Optional[Sequence[str]] = None,
+    quantization: Optional[str] = None,
+    candidates: Optional[int] = None,
+) -> List:
+    """
+    The `k` chunks nearest `query_embedding` in `column`, closest
+    first, as dicts from `create_search_result`. `book_titles`
+    restricts the search to those books. With `quantization`, the
+    `candidates` nearest by the quantized index (by default
+    `QUANTIZED_CANDIDATES`) are reranked.
+    """
+    if book_titles is not None and not book_titles:
+        return []
+
+    params = [Vector(query_embedding), k]
+    limit = k
+    if quantization is not None:
+        limit = quantized_pool(quantization, candidates, k)
+        params.append(limit)
+
+    with cursor() as cur:
+        apply_search_settings(cur, ef_search, probes, limit)
+        if not execute_search(
+            cur, "search", column, params, book_titles, quantization
+        ):
+            return []
+        return [create_search_result(row) for row in cur]
+
+
+def hybrid_search(
+    query_text: str,
+    query_embedding: Sequence[float],
+    column: str = "nomic_embeddings",
+    k: int = DEFAULT_K,
+    candidates: int = DEFAULT_CANDIDATES,
+    rrf_k: int = DEFAULT_RRF_K,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    book_titles: Optional[Sequence[str]] = None,
+) -> List:
+    """
+    The `k` best chunks for a query by reciprocal rank fusion of
+    vector and full-text search, as dicts from `create_hybrid_result`.
+    `query_text` takes web search syntax: "quoted phrases", OR, -not.
+
+    Unlike `search`, a `book_titles` filter is not routed to the
+    books' partitions: both sides filter the whole corpus with
+    book_title = ANY(...) and rely on the planner pruning partitions.
+    """
+    filtered = book_titles is not None
+    name = statement_name(
+        "hybrid", column, "books" if filtered else "all"
+    )
+    params = [Vector(query_embedding), query_text, candidates, rrf_k, k]
+    if filtered:
+        params.append(list(book_titles))
+
+    with cursor() as cur:
+        apply_search_settings(cur, ef_search, probes, candidates)
+        execute_prepared(
+            cur, name, hybrid_statement(column, filtered), params
+        )
+        return [create_hybrid_result(row) for row in cur]
+
+
+def mmr_search(
+    query_embedding: Sequence[float],
+    column: str = "nomic_embeddings",
+    k: int = DEFAULT_K,
+    candidates: int = DEFAULT_CANDIDATES,
+    lambda_: float = DEFAULT_MMR_LAMBDA,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    book_titles: Optional[Sequence[str]] = None,
+    quantization: Optional[str] = None,
+) -> List:
+    """
+    `k` chunks relevant to `query_embedding` but unlike each other,
+    chosen by MMR from the `candidates` nearest, in pick order. Lower
+    `lambda_` for more diversity. With `quantization`, the candidates
+    are the nearest by exact distance among a deeper pool from the
+    quantized index.
+    """
+    if book_titles is not None and not book_titles:
+        return []
+
+    params = [Vector(query_embedding), candidates]
+    limit = candidates
+    if quantization is not None:
+        limit = quantized_pool(quantization, None, candidates)
+        params.append(limit)
+
+    with cursor() as cur:
+        apply_search_settings(cur, ef_search, probes, limit)
+        if not execute_search(
+            cur,
+            "candidates",
+            column,
+            params,
+            book_titles,
+            quantization,
+            with_embeddings=True,
+        ):
+            return []
+        rows = cur.fetchall()
+
+    if not rows:
+        return []
+
+    embeddings = np.array([row[-1] for row in rows])
+    picked = mmr(query_embedding, embeddings, k, lambda_)
+    return [create_search_result(rows[index]) for index in picked]
+
+
+def timed_search(query_embedding, column, **options):
+    started = time.perf_counter()
+    results = search(query_embedding, column, **options)
+    return results, time.perf_counter() - started
+
+
+def fusion_search(
+    query_embeddings: Dict[str, Sequence[float]],
+    k: int = DEFAULT_K,
+    candidates: int = DEFAULT_CANDIDATES,
+    weights: Optional[Dict[str, float]] = None,
+    rrf_k: int = DEFAULT_RRF_K,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    book_titles: Optional[Sequence[str]] = None,
+):
+    """
+    Search each column in `query_embeddings` (column name to that
+    model's embedding of the query) concurrently and fuse the rankings
+    by weighted reciprocal rank fusion.
+
+    Returns the top `k` as "results" (search results with the fused
+    "score" and each column's "ranks"), and per column under "models"
+    its latency, the number of top-`k` results it ranked ("hits") and
+    its share of their fused score.
+    """
+    if not query_embeddings:
+        raise ValueError("fusion_search needs at least one embedding")
+
+    options = {
+        "k": candidates,
+        "ef_search": ef_search,
+        "probes": probes,
+        "book_titles": book_titles,
+    }
+
+    with ThreadPoolExecutor(max_workers=len(query_embeddings)) as pool:
+        futures = {
+            column: pool.submit(
+                timed_search, embedding, column, **options
+            )
+            for column, embedding in query_embeddings.items()
+        }
+        searches = {
+            column: future.result()
+            for column, future in futures.items()
+        }
+
+    chunks = {}
+    rankings = {}
+    for column, (results, _) in searches.items():
+        rankings[column] = [result["id"] for result in results]
+        for result in results:
+            chunks.setdefault(result["id"], result)
+
+    fused = weighted_rrf(rankings, weights, rrf_k)[:k]
+    report = contributions(fused, weights, rrf_k)
+
+    results = []
+    for entry in fused:
+        result = dict(chunks[entry["key"]])
+        # A distance is only meaningful within one model.
+        del result["distance"]
+        result["score"] = entry["score"]
+        result["ranks"] = entry["ranks"]
+        results.append(result)
+
+    models = {
+        column: {
+            "latency": latency,
+            "hits": report.get(column, {}).get("hits", 0),
+            "share": report.get(column, {}).get("share", 0.0),
+        }
+        for column, (_, latency) in searches.items()
+    }
+
+    return {"results": results, "models": models}
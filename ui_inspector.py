@@ -1,10 +1,15 @@
+import hashlib
 import os
 import pickle
 import time
 
-from books.a_crystal_age import chapter1, chapter2
-from chunker import SemanticChunker
-import spacy
+from books import get_book, get_chapter
+from chunker import (
+    SemanticChunker,
+    create_chunking_config,
+    load_chunking_model,
+)
+from doc_cache import DocCache
 import streamlit as st
 from ui_components import ConfigController
 
@@ -27,26 +32,54 @@ st.markdown(
 
 @st.cache_resource
 def load_spacy_model():
-    return spacy.load(
-        "en_core_web_md",
+    return load_chunking_model()
+
+
+@st.cache_resource
+def load_doc_cache():
+    return DocCache()
+
+
+# Chunk records for every (chapter, config) seen by any session, so
+# flipping back to an earlier setting renders without re-chunking.
+# The chapter text itself is left out of the cache key in favour of
+# its hash.
+@st.cache_data(max_entries=128, show_spinner=False)
+def chunk_chapter(chapter_hash, threshold, min_len, max_len, _text):
+    chunker = SemanticChunker(
+        nlp_model=load_spacy_model(),
+        config=create_chunking_config(
+            threshold=threshold,
+            min_len=min_len,
+            max_len=max_len,
+        ),
+        doc_cache=load_doc_cache(),
     )
 
+    result = chunker.run(_text, as_records=True)
+    del result["doc"]
+    return result
+
 
 # Initialize session_state to hold our results across reruns.
 if "processed_chunks" not in st.session_state:
     st.session_state.processed_chunks = []
 if "total_sentences" not in st.session_state:
     st.session_state.total_sentences = 0
+if "timings" not in st.session_state:
+    st.session_state.timings = {"parse": 0.0, "chunk": 0.0}
 if "current_chapter_name" not in st.session_state:
     st.session_state.current_chapter_name = "Chapter 1"
 
 
-nlp = load_spacy_model()
 config_controller = ConfigController()
 
+book_id = "a_crystal_age"
+book = get_book(book_id)
+
 chapters = {
-    "Chapter 1": chapter1,
-    "Chapter 2": chapter2,
+    "Chapter 1": "chapter1",
+    "Chapter 2": "chapter2",
 }
 
 st.sidebar.title("Chunking Inspector")
@@ -69,22 +102,24 @@ process_button_pressed = st.sidebar.button(
 
 # --- Main Logic: Gated by the Button Press ---
 if process_button_pressed:
-    selected_chapter_text = chapters[selected_chapter_name]
-    chunk_config = config_controller.get_chunking_config()
-
-    chunker = SemanticChunker(
-        nlp_model=nlp,
-        config=chunk_config,
+    selected_chapter_text = get_chapter(
+        book_id,
+        chapters[selected_chapter_name],
     )
+    chunk_config = config_controller.get_chunking_config()
 
     # When the button is pressed, we run the chunker and SAVE the results to session_state.
     with st.spinner("Chunking text..."):
-        st.session_state.processed_chunks = chunker.process(
-            selected_chapter_text
-        )
-        st.session_state.total_sentences = len(
-            list(nlp(selected_chapter_text).sents)
+        result = chunk_chapter(
+            hashlib.sha256(selected_chapter_text.encode()).hexdigest(),
+            chunk_config["threshold"],
+            chunk_config["min_len"],
+            chunk_config["max_len"],
+            selected_chapter_text,
         )
+        st.session_state.processed_chunks = result["chunks"]
+        st.session_state.total_sentences = result["sentence_count"]
+        st.session_state.timings = result["timings"]
         st.session_state.current_chapter_name = selected_chapter_name
 
 # --- Display Logic: Reads ONLY from Session State ---
@@ -93,31 +128,33 @@ col1, col2 = st.columns([3, 1])
 with col1:
     st.title("Chunking Results")
     st.markdown(
-        f"**Book:** `A Crystal Age` | **Chapter:** `{st.session_state.current_chapter_name}`"
+        f"**Book:** `{book['title']}` | **Chapter:** `{st.session_state.current_chapter_name}`"
     )
 
 with col2:
     if st.session_state.processed_chunks:
         if st.button("Save", type="primary", use_container_width=True):
             # Create filename: booktitle-chapter-epochtime.pkl
-            book_title = "a-crystal-age"
+            book_title = book_id.replace("_", "-")
             chapter_name = (
                 st.session_state.current_chapter_name.lower().replace(
                     " ", "-"
                 )
             )
+            chapter_text = get_chapter(
+                book_id,
+                chapters[st.session_state.current_chapter_name],
+            )
             epoch_time = int(time.time())
             filename = f"{book_title}-{chapter_name}-{epoch_time}.pkl"
             filepath = os.path.join("chunks", filename)
 
-            # Convert spaCy objects to serializable format
+            # Materialize the chunk records into a standalone format
             serializable_chunks = []
-            for chunk in st.session_state.processed_chunks:
+            for record in st.session_state.processed_chunks:
                 serializable_chunk = {
-                    "content": chunk["content"],
-                    "sentences": [
-                        sentence.text for sentence in chunk["sentences"]
-                    ],
+                    "content": record.text(chapter_text),
+                    "sentences": record.sentences(chapter_text),
                 }
                 serializable_chunks.append(serializable_chunk)
 
@@ -127,7 +164,7 @@ with col2:
 
             st.success(f"Chunks saved to {filename}")
 
-metrics_col1, metrics_col2 = st.columns(2)
+metrics_col1, metrics_col2, metrics_col3, metrics_col4 = st.columns(4)
 
 metrics_col1.metric(
     label="Total Sentences", value=st.session_state.total_sentences
@@ -138,6 +175,16 @@ metrics_col2.metric(
     value=len(st.session_state.processed_chunks),
 )
 
+metrics_col3.metric(
+    label="Parse Time",
+    value=f"{st.session_state.timings['parse'] * 1000:.0f} ms",
+)
+
+metrics_col4.metric(
+    label="Chunking Time",
+    value=f"{st.session_state.timings['chunk'] * 1000:.0f} ms",
+)
+
 st.divider()
 
 st.header("Chunk and Sentence Breakdown")
@@ -147,10 +194,15 @@ if not st.session_state.processed_chunks:
         "Adjust parameters in the sidebar and click 'Process Chapter' to begin."
     )
 else:
+    chapter_text = get_chapter(
+        book_id,
+        chapters[st.session_state.current_chapter_name],
+    )
+
     # This loop now displays the PERSISTENT results from session_state.
-    for i, chunk in enumerate(st.session_state.processed_chunks):
-        chunk_text = chunk["content"]
-        source_sentences = chunk["sentences"]
+    for i, record in enumerate(st.session_state.processed_chunks):
+        chunk_text = record.text(chapter_text)
+        source_sentences = record.sentences(chapter_text)
 
         expander_title = (
             f"Chunk #{i + 1}   |   "
@@ -163,4 +215,4 @@ else:
 
             st.subheader("Source Sentences")
             for sentence in source_sentences:
-                st.markdown(f"- *{sentence.text.strip()}*")
+                st.markdown(f"- *{sentence.strip()}*")
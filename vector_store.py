@@ -0,0 +1,274 @@
+"""
+Vector store backends with one interface.
+
+`PostgresVectorStore` is a thin wrapper over `search.py`.
+`NumpyVectorStore` needs no services at all: each embedding column is
+an (n, dim) float32 `.npy` file, memory-mapped read-only, next to a
+`chunks.json` of the rows' metadata in the same order. It answers the
+same top-k, book-filtered and MMR queries exactly, by brute force,
+which makes it the reference for benchmarking the indexes too.
+
+`get_vector_store` picks the backend from VECTOR_BACKEND ("postgres",
+the default, or "numpy"); the NumPy store is read from
+VECTOR_STORE_DIR. Write one from loader rows with `build_numpy_store`.
+"""
+
+import json
+from os import getenv
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from corpus_loader import EMBEDDING_COLUMNS
+from ranking import DEFAULT_MMR_LAMBDA, mmr
+from search import (
+    DEFAULT_CANDIDATES,
+    DEFAULT_K,
+    RESULT_COLUMNS,
+    create_search_result,
+    mmr_search,
+    search,
+)
+
+DEFAULT_STORE_DIR = Path(__file__).parent / "data" / "vectors"
+METADATA_NAME = "chunks.json"
+
+
+def build_numpy_store(
+    rows: Iterable, directory: Path = DEFAULT_STORE_DIR
+):
+    """
+    Write `rows` (dicts from `create_corpus_row`) as a NumPy store.
+    Rows without an "id" are numbered from 1 in order, as a fresh load
+    into Postgres would number them. A missing embedding is stored as
+    zeros, which the store never returns for that column.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    rows = list(rows)
+    metadata = [
+        dict(
+            {name: row.get(name) for name in RESULT_COLUMNS},
+            id=row.get("id", number),
+        )
+        for number, row in enumerate(rows, start=1)
+    ]
+
+    for column in EMBEDDING_COLUMNS:
+        present = [
+            row[column] for row in rows if row[column] is not None
+        ]
+        if not present:
+            continue
+
+        dim = len(present[0])
+        matrix = np.zeros((len(rows), dim), dtype=np.float32)
+        for index, row in enumerate(rows):
+            if row[column] is not None:
+                matrix[index] = row[column]
+
+        np.save(directory / f"{column}.npy", matrix)
+
+    with open(directory / METADATA_NAME, "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+
+class NumpyVectorStore:
+    def __init__(self, directory: Path = DEFAULT_STORE_DIR):
+        directory = Path(directory)
+
+        with open(directory / METADATA_NAME, encoding="utf-8") as f:
+            self.chunks = json.load(f)
+
+        self.matrices = {}
+        self.norms = {}
+        for column in EMBEDDING_COLUMNS:
+            path = directory / f"{column}.npy"
+            if path.exists():
+                matrix = np.load(path, mmap_mode="r")
+                self.matrices[column] = matrix
+                self.norms[column] = np.linalg.norm(matrix, axis=1)
+
+        self.book_rows = {}
+        for index, chunk in enumerate(self.chunks):
+            self.book_rows.setdefault(chunk["book_title"], []).append(
+                index
+            )
+        self.book_rows = {
+            title: np.array(indices)
+            for title, indices in self.book_rows.items()
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def candidate_rows(
+        self, book_titles: Optional[Sequence[str]]
+    ) -> Optional[np.ndarray]:
+        if book_titles is None:
+            return None
+
+        selected = [
+            self.book_rows[title]
+            for title in book_titles
+            if title in self.book_rows
+        ]
+        if not selected:
+            return np.array([], dtype=int)
+        return np.sort(np.concatenate(selected))
+
+    def nearest(
+        self,
+        query_embedding: Sequence[float],
+        column: str,
+        k: int,
+        book_titles: Optional[Sequence[str]],
+    ):
+        """
+        Row indices of the `k` nearest rows by cosine distance, closest
+        first, and their distances.
+        """
+        if column not in self.matrices:
+            raise ValueError(f"No embeddings stored for {column}")
+
+        rows = self.candidate_rows(book_titles)
+        matrix = self.matrices[column]
+        norms = self.norms[column]
+        if rows is not None:
+            matrix = matrix[rows]
+            norms = norms[rows]
+        else:
+            rows = np.arange(len(matrix))
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        similarity = (matrix @ query) / (
+            np.where(norms == 0, 1, norms) * np.linalg.norm(query)
+        )
+        distance = 1.0 - similarity.astype(np.float64)
+        # Rows without this embedding are never results.
+        distance[norms == 0] = np.inf
+
+        k = min(k, int(np.isfinite(distance).sum()))
+        if k == 0:
+            return rows[:0], distance[:0]
+
+        top = np.argpartition(distance, k - 1)[:k]
+        top = top[np.argsort(distance[top], kind="stable")]
+        return rows[top], distance[top]
+
+    def result(self, index: int, distance: float):
+        chunk = self.chunks[index]
+        return create_search_result(
+            [chunk[name] for name in RESULT_COLUMNS] + [float(distance)]
+        )
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        column: str = "nomic_embeddings",
+        k: int = DEFAULT_K,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        book_titles: Optional[Sequence[str]] = None,
+        quantization: Optional[str] = None,
+        candidates: Optional[int] = None,
+    ) -> List:
+        # ef_search, probes and quantization trade accuracy for speed
+        # in Postgres; search here is exact.
+        rows, distances = self.nearest(
+            query_embedding, column, k, book_titles
+        )
+        return [
+            self.result(row, distance)
+            for row, distance in zip(rows, distances)
+        ]
+
+    def mmr_search(
+        self,
+        query_embedding: Sequence[float],
+        column: str = "nomic_embeddings",
+        k: int = DEFAULT_K,
+        candidates: int = DEFAULT_CANDIDATES,
+        lambda_: float = DEFAULT_MMR_LAMBDA,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        book_titles: Optional[Sequence[str]] = None,
+        quantization: Optional[str] = None,
+    ) -> List:
+        rows, distances = self.nearest(
+            query_embedding, column, candidates, book_titles
+        )
+        if not len(rows):
+            return []
+
+        embeddings = np.asarray(self.matrices[column][rows])
+        picked = mmr(query_embedding, embeddings, k, lambda_)
+        return [self.result(rows[i], distances[i]) for i in picked]
+
+
+class PostgresVectorStore:
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        column: str = "nomic_embeddings",
+        k: int = DEFAULT_K,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        book_titles: Optional[Sequence[str]] = None,
+        quantization: Optional[str] = None,
+        candidates: Optional[int] = None,
+    ) -> List:
+        return search(
+            query_embedding,
+            column,
+            k,
+            ef_search=ef_search,
+            probes=probes,
+            book_titles=book_titles,
+            quantization=quantization,
+            candidates=candidates,
+        )
+
+    def mmr_search(
+        self,
+        query_embedding: Sequence[float],
+        column: str = "nomic_embeddings",
+        k: int = DEFAULT_K,
+        candidates: int = DEFAULT_CANDIDATES,
+        lambda_: float = DEFAULT_MMR_LAMBDA,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        book_titles: Optional[Sequence[str]] = None,
+        quantization: Optional[str] = None,
+    ) -> List:
+        return mmr_search(
+            query_embedding,
+            column,
+            k,
+            candidates,
+            lambda_,
+            ef_search=ef_search,
+            probes=probes,
+            book_titles=book_titles,
+            quantization=quantization,
+        )
+
+
+VECTOR_BACKENDS: Dict[str, type] = {
+    "postgres": PostgresVectorStore,
+    "numpy": NumpyVectorStore,
+}
+
+
+def get_vector_store(backend: Optional[str] = None):
+    backend = backend or getenv("VECTOR_BACKEND", "postgres")
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown vector backend: {backend}")
+
+    if backend == "numpy":
+        return NumpyVectorStore(
+            Path(getenv("VECTOR_STORE_DIR", DEFAULT_STORE_DIR))
+        )
+    return PostgresVectorStore()